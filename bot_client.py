@@ -0,0 +1,198 @@
+"""Headless bot clients for putting load on server.py.
+
+Spawns pairs of bots that join, play cards with a random or scripted
+policy until the time runs out, and then print throughput, choice ->
+round_result latency and bytes per round. Bots ask for rooms without
+round pauses, so they measure the server rather than the pauses, while
+human players on the same server keep theirs (--with-pauses plays at
+human pace instead):
+
+    python server.py
+    python bot_client.py --pairs 2000 --duration 30
+    python bot_client.py --pairs 10 --spectators 1000   # fan-out to many viewers
+
+Thousands of bots need a matching open-file limit (ulimit -n).
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import protocol
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 65432
+
+
+def new_stats():
+    return {"rounds": 0, "games": 0, "latencies": [], "bytes_in": 0, "bytes_out": 0, "errors": 0, "connected": 0, "resyncs": 0,
+            "spectator_frames": 0, "spectator_bytes": 0, "hands_leaked": 0}
+
+def pick_card(hand, policy, round_number):
+    """Returns the hand index a bot plays: random, or the next rps value from a script like "0,2,1"."""
+    if policy == "random":
+        return random.randrange(len(hand))
+    script = [int(v) for v in policy.split(",")]
+    wanted = script[round_number % len(script)]
+    return next((i for i, card in enumerate(hand) if card["rps_value"] == wanted), 0)
+
+async def run_bot(bot_id, host, port, policy, no_pauses, deadline, stats):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        stats["errors"] += 1
+        return
+    stats["connected"] += 1
+
+    def send(message_type, data):
+        frame = protocol.encode_message(message_type, data)
+        stats["bytes_out"] += len(frame)
+        writer.write(frame)
+
+    decoder = protocol.FrameDecoder()
+    round_number, choice_sent_at = 0, None
+    state, last_seq = {}, None
+    send("ready", {"username": f"bot-{bot_id}", "no_pauses": no_pauses})
+    try:
+        while time.monotonic() < deadline:
+            try:
+                chunk = await asyncio.wait_for(reader.read(4096), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            stats["bytes_in"] += len(chunk)
+            decoder.feed(chunk)
+            for msg_type, msg_data in decoder.frames():
+                if msg_type == "ping":
+                    send("pong", {})
+                elif msg_type == "state_snapshot":
+                    state, last_seq = dict(msg_data["fields"]), msg_data["seq"]
+                    msg_type, msg_data = msg_data["kind"], state
+                elif msg_type == "state_delta":
+                    if last_seq is None or msg_data["seq"] != (last_seq + 1) & protocol.SEQ_MASK:
+                        if last_seq is not None:   # otherwise a resync is already on its way
+                            stats["resyncs"] += 1
+                            send("resync", {})
+                        last_seq = None
+                        continue
+                    state.update(msg_data["fields"])
+                    msg_type, msg_data, last_seq = msg_data["kind"], state, msg_data["seq"]
+                if msg_type == "game_state":
+                    if msg_data["round_status"] == "waiting_for_choices" and msg_data["player_hand"]:
+                        choice_sent_at = time.perf_counter()
+                        send("choice", {"index": pick_card(msg_data["player_hand"], policy, round_number)})
+                    elif msg_data["round_status"] == "entering_username":
+                        send("ready", {"username": f"bot-{bot_id}", "no_pauses": no_pauses})
+                elif msg_type == "round_result":
+                    if choice_sent_at is not None:
+                        stats["latencies"].append(time.perf_counter() - choice_sent_at)
+                        choice_sent_at = None
+                    stats["rounds"] += 1
+                    round_number += 1
+                    if msg_data["game_over"]:
+                        stats["games"] += 1
+                elif msg_type == "error":
+                    stats["errors"] += 1
+                    return
+            await writer.drain()
+    except (ConnectionResetError, BrokenPipeError, protocol.ProtocolError):
+        stats["errors"] += 1
+    finally:
+        writer.close()
+
+async def run_spectator(host, port, deadline, stats):
+    """Watches the newest match, and the next one whenever it ends, checking no hand is ever shown."""
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        stats["errors"] += 1
+        return
+    decoder = protocol.FrameDecoder()
+    state, last_seq = {}, None
+    writer.write(protocol.encode_message("spectate", {"room_id": 0xFFFFFFFF}))
+    try:
+        while time.monotonic() < deadline:
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            stats["spectator_bytes"] += len(chunk)
+            decoder.feed(chunk)
+            for msg_type, msg_data in decoder.frames():
+                stats["spectator_frames"] += 1
+                if msg_type == "ping":
+                    writer.write(protocol.encode_message("pong", {}))
+                elif msg_type == "state_snapshot":
+                    state, last_seq = dict(msg_data["fields"]), msg_data["seq"]
+                    msg_type, msg_data = msg_data["kind"], state
+                elif msg_type == "state_delta":
+                    if last_seq is None or msg_data["seq"] != (last_seq + 1) & protocol.SEQ_MASK:
+                        if last_seq is not None:
+                            stats["resyncs"] += 1
+                            writer.write(protocol.encode_message("resync", {}))
+                        last_seq = None
+                        continue
+                    state.update(msg_data["fields"])
+                    msg_type, msg_data, last_seq = msg_data["kind"], state, msg_data["seq"]
+                if msg_type == "game_state" and msg_data["player_hand"]:
+                    stats["hands_leaked"] += 1
+                # Between matches (or before the first one starts) look for the next one.
+                if msg_type == "error" or (msg_type == "game_state" and msg_data["round_status"] == "entering_username"):
+                    await asyncio.sleep(0.1)
+                    last_seq = None
+                    writer.write(protocol.encode_message("spectate", {"room_id": 0xFFFFFFFF}))
+    except (ConnectionResetError, BrokenPipeError, protocol.ProtocolError):
+        stats["errors"] += 1
+    finally:
+        writer.close()
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def report(stats, elapsed):
+    # Every round is seen by both bots of a pair.
+    rounds = stats["rounds"] / 2
+    games = stats["games"] / 2
+    latencies = sorted(stats["latencies"])
+    total_bytes = stats["bytes_in"] + stats["bytes_out"]
+    print(f"Bots connected:      {stats['connected']} ({stats['errors']} errors, {stats['resyncs']} resyncs)")
+    print(f"Rounds played:       {rounds:.0f} ({games:.0f} games) in {elapsed:.1f}s")
+    print(f"Rounds/second:       {rounds / elapsed:.1f}")
+    print(f"Choice latency p50:  {percentile(latencies, 0.50) * 1000:.2f} ms")
+    print(f"Choice latency p99:  {percentile(latencies, 0.99) * 1000:.2f} ms")
+    if rounds:
+        print(f"Bytes per round:     {total_bytes / rounds:.1f} (in {stats['bytes_in'] / rounds:.1f}, out {stats['bytes_out'] / rounds:.1f})")
+    if stats["spectator_frames"]:
+        print(f"Spectator frames:    {stats['spectator_frames']} ({stats['spectator_bytes'] / elapsed / 1024:.1f} KiB/s, "
+              f"{stats['hands_leaked']} hands leaked)")
+
+async def main(args):
+    stats = new_stats()
+    started = time.monotonic()
+    deadline = started + args.duration
+    bots = []
+    for bot_id in range(2 * args.pairs):
+        bots.append(asyncio.create_task(run_bot(bot_id, args.host, args.port, args.policy, not args.with_pauses, deadline, stats)))
+        if bot_id % args.connect_batch == args.connect_batch - 1:
+            await asyncio.sleep(0.01)
+    for _ in range(args.spectators):
+        bots.append(asyncio.create_task(run_spectator(args.host, args.port, deadline, stats)))
+    await asyncio.gather(*bots)
+    report(stats, time.monotonic() - started)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless load generator for server.py")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--pairs", type=int, default=100, help="number of bot pairs (matches) to run")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to play before reporting")
+    parser.add_argument("--policy", default="random", help='"random", or a cycling rps script such as "0,2,1"')
+    parser.add_argument("--with-pauses", action="store_true", help="play with the server's round pauses like a human player")
+    parser.add_argument("--spectators", type=int, default=0, help="spectator connections watching the newest matches")
+    parser.add_argument("--connect-batch", type=int, default=200, help="connections opened per 10 ms while ramping up")
+    asyncio.run(main(parser.parse_args()))
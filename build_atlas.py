@@ -0,0 +1,69 @@
+"""Packs the card images into one prebuilt atlas for the clients.
+
+Each card PNG is padded and scaled to MAX_CARD_IMAGE_HEIGHT exactly as the
+client's load_and_scale_image does, and the results are packed in rows into
+raw RGBA pixels (assets/card_atlas.rgba) that the client memory-maps at
+startup, plus a JSON manifest (assets/card_atlas.json) with each card's
+rectangle. Re-run after changing any card image:
+
+    python build_atlas.py
+"""
+import json
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+ATLAS_IMAGE = os.path.join(ASSETS_DIR, 'card_atlas.rgba')
+ATLAS_MANIFEST = os.path.join(ASSETS_DIR, 'card_atlas.json')
+ATLAS_VERSION = 1
+ATLAS_MAX_WIDTH = 1024
+MAX_CARD_IMAGE_HEIGHT = 120
+PADDING = 5
+CARD_FILE_PATTERNS = {'power': "{rps}_power{owner}.png", 'counter': "{rps}_counter{owner}.png", 'none': "{rps}{owner}.png"}
+
+
+def load_card(file_name):
+    original_image = pygame.image.load(os.path.join(ASSETS_DIR, file_name))
+    padded_size = (original_image.get_width() + 2 * PADDING, original_image.get_height() + 2 * PADDING)
+    padded_surface = pygame.Surface(padded_size, pygame.SRCALPHA)
+    padded_surface.blit(original_image, (PADDING, PADDING))
+    w, h = padded_surface.get_size()
+    scale = MAX_CARD_IMAGE_HEIGHT / h
+    return pygame.transform.smoothscale(padded_surface, (int(w * scale), MAX_CARD_IMAGE_HEIGHT))
+
+def build_atlas():
+    cards = {}
+    for rps_type in ["rock", "paper", "scissors"]:
+        for effect_key, pattern in CARD_FILE_PATTERNS.items():
+            for owner in [0, 1]:
+                file_name = pattern.format(rps=rps_type, owner=owner)
+                try:
+                    cards[f"{rps_type}/{effect_key}/{owner}"] = load_card(file_name)
+                except (pygame.error, FileNotFoundError) as e:
+                    print(f"Warning: Could not load {file_name}. {e}")
+
+    # Every card has the same height, so packing is just filling rows left to right.
+    rects, x, y = {}, 0, 0
+    for key, surface in cards.items():
+        w, h = surface.get_size()
+        if x + w > ATLAS_MAX_WIDTH:
+            x, y = 0, y + MAX_CARD_IMAGE_HEIGHT
+        rects[key] = [x, y, w, h]
+        x += w
+    width = max(rect[0] + rect[2] for rect in rects.values())
+    height = y + MAX_CARD_IMAGE_HEIGHT
+
+    atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+    for key, surface in cards.items():
+        atlas.blit(surface, rects[key][:2])
+    with open(ATLAS_IMAGE, 'wb') as f:
+        f.write(pygame.image.tostring(atlas, "RGBA"))
+    with open(ATLAS_MANIFEST, 'w') as f:
+        json.dump({"version": ATLAS_VERSION, "card_height": MAX_CARD_IMAGE_HEIGHT, "size": [width, height], "cards": rects}, f, indent=2)
+    print(f"Packed {len(rects)} cards into a {width}x{height} atlas.")
+
+if __name__ == "__main__":
+    pygame.init()
+    build_atlas()
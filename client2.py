@@ -1,16 +1,21 @@
 import pygame
 import socket
-import pickle
 import threading
 import sys
 import time
 import os
 import random
+import json
+import mmap
+import queue
+from collections import OrderedDict
+from types import MappingProxyType
+
+import protocol
 
 # --- Network Configuration ---
 SERVER_HOST = '127.0.0.1' 
 SERVER_PORT = 65432
-HEADER_LENGTH = 10 
 
 pygame.init()
 
@@ -98,11 +103,13 @@ card_images = {
     'paper': {'power': {0: None, 1: None}, 'counter': {0: None, 1: None}, 'none': {0: None, 1: None}}, 
     'scissors': {'power': {0: None, 1: None}, 'counter': {0: None, 1: None}, 'none': {0: None, 1: None}} 
 }
-player_0_background, player_1_background = None, None
-win_screen_img, lose_screen_img = None, None
-hp_bar_bg_img, heart_icon_img = None, None
-ready_bg_img, avatar0_img, avatar1_img = None, None, None
-join_bg0_img, join_bg1_img = None, None
+CARD_FILE_PATTERNS = {'power': "{rps}_power{owner}.png", 'counter': "{rps}_counter{owner}.png", 'none': "{rps}{owner}.png"}
+# Prebuilt by build_atlas.py; the client falls back to the card PNGs when it is missing or stale.
+ATLAS_IMAGE = os.path.join(ASSETS_DIR, 'card_atlas.rgba')
+ATLAS_MANIFEST = os.path.join(ASSETS_DIR, 'card_atlas.json')
+ATLAS_VERSION = 1
+# Backgrounds, avatars and HP bar art are loaded the first time a screen draws them.
+screen_images = {}
 
 def load_and_scale_image(file_name, max_height):
     path = os.path.join(ASSETS_DIR, file_name)
@@ -122,51 +129,120 @@ def load_and_scale_image(file_name, max_height):
         print(f"Warning: Could not load {file_name}. {e}")
         return None
 
-player_0_background = load_and_scale_image('player2screen_bg.png', 0)
-player_1_background = load_and_scale_image('player1screen_bg.png', 0)
-win_screen_img = load_and_scale_image('win_screen.png', 0)
-lose_screen_img = load_and_scale_image('lose_screen.png', 0)
-hp_bar_bg_img = load_and_scale_image('hp_bar_bg.png', 0)
-heart_icon_img = load_and_scale_image('heart_icon.png', 0)
-ready_bg_img = load_and_scale_image('ready_bg.png', 0)
-avatar0_img = load_and_scale_image('avatar0.png', 0)
-avatar1_img = load_and_scale_image('avatar1.png', 0)
-join_bg0_img = load_and_scale_image('join_bg0.png', 0)
-join_bg1_img = load_and_scale_image('join_bg1.png', 0) 
-
-# Load all cards
-for rps_type in ["rock", "paper", "scissors"]:
-    for player_id_suffix in [0, 1]:
-        # Load power attack images (e.g., rock_power0.png)
-        power_filename = f"{rps_type}_power{player_id_suffix}.png"
-        card_images[rps_type]['power'][player_id_suffix] = load_and_scale_image(power_filename, MAX_CARD_IMAGE_HEIGHT)
-        
-        # Load counter images (e.g., rock_counter0.png)
-        counter_filename = f"{rps_type}_counter{player_id_suffix}.png"
-        card_images[rps_type]['counter'][player_id_suffix] = load_and_scale_image(counter_filename, MAX_CARD_IMAGE_HEIGHT)
-
-        # Load standard images (e.g., rock0.png)
-        none_filename = f"{rps_type}{player_id_suffix}.png"
-        card_images[rps_type]['none'][player_id_suffix] = load_and_scale_image(none_filename, MAX_CARD_IMAGE_HEIGHT)
-
-
-client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-connected_to_server = False
+def get_image(file_name):
+    if file_name not in screen_images:
+        screen_images[file_name] = load_and_scale_image(file_name, 0)
+    return screen_images[file_name]
 
+def load_card_atlas():
+    """Fills card_images from the prebuilt atlas. Returns False if the atlas is missing or stale."""
+    try:
+        with open(ATLAS_MANIFEST) as f:
+            manifest = json.load(f)
+        if manifest["version"] != ATLAS_VERSION or manifest["card_height"] != MAX_CARD_IMAGE_HEIGHT:
+            return False
+        with open(ATLAS_IMAGE, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) as pixels:
+            atlas = pygame.image.frombuffer(pixels, tuple(manifest["size"]), "RGBA").convert_alpha()
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, KeyError, pygame.error) as e:
+        print(f"Warning: Could not load card atlas, loading card images one by one. {e}")
+        return False
+    for key, rect in manifest["cards"].items():
+        rps_type, effect_key, owner = key.split("/")
+        card_images[rps_type][effect_key][int(owner)] = atlas.subsurface(rect)
+    return True
 
-def draw_text_with_shadow(text, font, color, x, y, center=True, stroke=True):
+# Load all cards
+if not load_card_atlas():
+    for rps_type in ["rock", "paper", "scissors"]:
+        for player_id_suffix in [0, 1]:
+            # e.g. rock_power0.png, rock_counter0.png, rock0.png
+            for effect_key, pattern in CARD_FILE_PATTERNS.items():
+                card_filename = pattern.format(rps=rps_type, owner=player_id_suffix)
+                card_images[rps_type][effect_key][player_id_suffix] = load_and_scale_image(card_filename, MAX_CARD_IMAGE_HEIGHT)
+
+
+# --- Scaled Surface Cache ---
+# Scaled copies of the source images, keyed by (image, size), least recently used dropped first.
+# Cleared whenever the window size changes, since most sizes are derived from it.
+SCALED_CACHE_SIZE = 128
+scaled_surface_cache = OrderedDict()
+
+def get_scaled(image, size, smooth=True):
+    size = (int(size[0]), int(size[1]))
+    key = (id(image), size, smooth)
+    scaled = scaled_surface_cache.get(key)
+    if scaled is not None:
+        scaled_surface_cache.move_to_end(key)
+        return scaled
+    scaled = pygame.transform.smoothscale(image, size) if smooth else pygame.transform.scale(image, size)
+    scaled_surface_cache[key] = scaled
+    if len(scaled_surface_cache) > SCALED_CACHE_SIZE:
+        scaled_surface_cache.popitem(last=False)
+    return scaled
+
+# --- Text Cache ---
+# Fonts by point size, and finished labels (shadow + stroke + text composited into one surface)
+# by (text, font, color, stroke), least recently used dropped first.
+TEXT_CACHE_SIZE = 256
+font_cache = {}
+text_cache = OrderedDict()
+
+def get_font(size):
+    font = font_cache.get(size)
+    if font is None:
+        font = font_cache[size] = pygame.font.Font(font_name, size)
+    return font
+
+def get_text_label(text, font, color, stroke=True):
+    key = (text, font, color, stroke)
+    label = text_cache.get(key)
+    if label is not None:
+        text_cache.move_to_end(key)
+        return label
     text_surface = font.render(text, True, color)
-    shadow_surface = font.render(text, True, SHADOW_COLOR)
-    shadow_rect = shadow_surface.get_rect(center=(x + 3, y + 3) if center else (x + 3, y + 3))
-    screen.blit(shadow_surface, shadow_rect)
+    # The text sits at (1, 1) so the stroke fits at -1 and the shadow at +3.
+    label = pygame.Surface((text_surface.get_width() + 4, text_surface.get_height() + 4), pygame.SRCALPHA)
+    label.blit(font.render(text, True, SHADOW_COLOR), (4, 4))
     if stroke:
         stroke_surface = font.render(text, True, BLACK)
         stroke_offsets = [(-1, -1), (1, -1), (-1, 1), (1, 1), (-1, 0), (1, 0), (0, -1), (0, 1)]
         for dx, dy in stroke_offsets:
-            stroke_rect = stroke_surface.get_rect(center=(x + dx, y + dy) if center else (x + dx, y + dy))
-            screen.blit(stroke_surface, stroke_rect)
-    text_rect = text_surface.get_rect(center=(x, y) if center else (x,y))
-    screen.blit(text_surface, text_rect)
+            label.blit(stroke_surface, (1 + dx, 1 + dy))
+    label.blit(text_surface, (1, 1))
+    text_cache[key] = label
+    if len(text_cache) > TEXT_CACHE_SIZE:
+        text_cache.popitem(last=False)
+    return label
+
+# --- Dirty Rendering ---
+# With DIRTY_RENDERING on, the window is only repainted when something changed: a key press,
+# click, resize, network update or the pointer moving onto or off a button repaints it fully,
+# running card/HP animations repaint just their regions, and the loop sleeps in
+# pygame.event.wait() while nothing animates. Drawn frames are capped at 60 per second.
+DIRTY_RENDERING = True
+IDLE_WAIT_MS = 250
+NETWORK_EVENT = pygame.USEREVENT + 1
+REDRAW_EVENTS = {pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.VIDEORESIZE, pygame.VIDEOEXPOSE,
+                 pygame.WINDOWEXPOSED, NETWORK_EVENT}   # events that can change what is on screen
+network_updates = queue.SimpleQueue()   # (message type, read-only data) from the receive thread
+ANIMATION_EPSILON = 0.001
+hp_bar_rects = {}
+button_rects = {}   # label -> rect of each button on the last full repaint, to notice hover changes
+
+client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+connected_to_server = False
+resume_token = None      # issued with player_id; lets a dropped connection rejoin its match
+receive_thread = None
+CONNECT_TIMEOUT = 5.0
+RECONNECT_ATTEMPTS = 10
+RECONNECT_DELAY = 1.0
+
+def draw_text_with_shadow(text, font, color, x, y, center=True, stroke=True):
+    label = get_text_label(text, font, color, stroke)
+    # The label's center is one pixel right of and below the text's center.
+    return screen.blit(label, label.get_rect(center=(x + 1, y + 1)))
 
 def draw_wrapped_text_with_shadow(text, font, color, rect):
     def get_lines(txt, f, max_width):
@@ -193,10 +269,11 @@ def draw_wrapped_text_with_shadow(text, font, color, rect):
 def draw_hp_bar(current_hp, max_hp, x, y, width, height, player_label, shake_offset=(0, 0)):
     x += shake_offset[0]
     y += shake_offset[1]
+    hp_bar_bg_img, heart_icon_img = get_image('hp_bar_bg.png'), get_image('heart_icon.png')
     if not hp_bar_bg_img or not heart_icon_img: return
     if current_hp < 0: current_hp = 0
     hp_ratio = current_hp / max_hp
-    scaled_bg = pygame.transform.smoothscale(hp_bar_bg_img, (width, height))
+    scaled_bg = get_scaled(hp_bar_bg_img, (width, height))
     bg_rect = scaled_bg.get_rect(topleft=(x, y))
     screen.blit(scaled_bg, bg_rect)
     if hp_ratio > 0.6: hp_color = HP_GREEN
@@ -208,14 +285,16 @@ def draw_hp_bar(current_hp, max_hp, x, y, width, height, player_label, shake_off
     fill_rect = pygame.Rect(x + padding, y + padding, fill_width, fill_height)
     pygame.draw.rect(screen, hp_color, fill_rect, border_radius=int(fill_height / 2))
     icon_size = int(height * 1.5)
-    scaled_icon = pygame.transform.smoothscale(heart_icon_img, (icon_size, icon_size))
+    scaled_icon = get_scaled(heart_icon_img, (icon_size, icon_size))
     icon_rect = scaled_icon.get_rect(center=(x + padding, bg_rect.centery))
     screen.blit(scaled_icon, icon_rect)
     hp_text = str(int(current_hp))
-    draw_text_with_shadow(hp_text, font_hp, WHITE, bg_rect.centerx + (icon_size / 4), bg_rect.centery)
-    draw_text_with_shadow(player_label, font_small, WHITE, bg_rect.centerx, bg_rect.top - 20)
+    hp_text_rect = draw_text_with_shadow(hp_text, font_hp, WHITE, bg_rect.centerx + (icon_size / 4), bg_rect.centery)
+    label_rect = draw_text_with_shadow(player_label, font_small, WHITE, bg_rect.centerx, bg_rect.top - 20)
+    return bg_rect.unionall([icon_rect, hp_text_rect, label_rect])
 
 def draw_button(rect, text, font, color, text_color, hover_color=None):
+    button_rects[text] = rect
     mouse_pos = pygame.mouse.get_pos()
     is_hovered = rect.collidepoint(mouse_pos)
     current_color = hover_color if is_hovered and hover_color else color
@@ -261,7 +340,7 @@ def draw_card_as_image_button(x, y, card_data, is_selected, owner_id=None, is_cl
     scaled_h = int(base_image.get_height() * current_scale)
     if scaled_w <= 0 or scaled_h <= 0: return pygame.Rect(x,y,0,0)
 
-    scaled_image = pygame.transform.smoothscale(base_image, (scaled_w, scaled_h))
+    scaled_image = get_scaled(base_image, (scaled_w, scaled_h))
     display_image = scaled_image
     
     if is_selected:
@@ -278,31 +357,33 @@ def draw_card_as_image_button(x, y, card_data, is_selected, owner_id=None, is_cl
 
     scaled_name_size = max(1, int(24 * extra_scale))
     scaled_effect_size = max(1, int(18 * extra_scale))
-    scaled_name_font = pygame.font.Font(font_name, scaled_name_size)
-    scaled_effect_font = pygame.font.Font(font_name, scaled_effect_size)
+    scaled_name_font = get_font(scaled_name_size)
+    scaled_effect_font = get_font(scaled_effect_size)
 
     text_y_anchor = image_rect.bottom + (15 * extra_scale)
     draw_text_with_shadow(card_name, scaled_name_font, WHITE, x, text_y_anchor)
     draw_text_with_shadow(effect_text, scaled_effect_font, WHITE, x, text_y_anchor + (30 * extra_scale))
     
-    name_rect = scaled_name_font.render(card_name, True, WHITE).get_rect(centerx=x, top=text_y_anchor)
-    effect_rect = scaled_effect_font.render(effect_text, True, WHITE).get_rect(centerx=x, top=name_rect.bottom)
+    name_rect = pygame.Rect((0, 0), scaled_name_font.size(card_name))
+    name_rect.midtop = (x, text_y_anchor)
+    effect_rect = pygame.Rect((0, 0), scaled_effect_font.size(effect_text))
+    effect_rect.midtop = (x, name_rect.bottom)
     interaction_rect = image_rect.unionall([name_rect, effect_rect])
     return interaction_rect
 
 def draw_game_screen(sw, sh, shake_offsets):
     if round_status == "entering_username":
-        bg_img = join_bg1_img if player_id == 1 and join_bg1_img else join_bg0_img
-        avatar_img = avatar1_img if player_id == 1 and avatar1_img else avatar0_img
+        bg_img = (get_image('join_bg1.png') if player_id == 1 else None) or get_image('join_bg0.png')
+        avatar_img = (get_image('avatar1.png') if player_id == 1 else None) or get_image('avatar0.png')
 
         if bg_img:
-            screen.blit(pygame.transform.smoothscale(bg_img, (sw, sh)), (0, 0))
+            screen.blit(get_scaled(bg_img, (sw, sh)), (0, 0))
         else:
             screen.fill((27, 133, 93))
         
         if avatar_img:
             avatar_size = int(sw * 0.18)
-            scaled_avatar = pygame.transform.smoothscale(avatar_img, (avatar_size, avatar_size))
+            scaled_avatar = get_scaled(avatar_img, (avatar_size, avatar_size))
             avatar_rect = scaled_avatar.get_rect(center=(sw * 0.72, sh * 0.45))
             screen.blit(scaled_avatar, avatar_rect)
         
@@ -325,8 +406,10 @@ def draw_game_screen(sw, sh, shake_offsets):
         return
 
     if round_status == "waiting_for_players":
+        ready_bg_img = get_image('ready_bg.png')
+        avatar0_img, avatar1_img = get_image('avatar0.png'), get_image('avatar1.png')
         if ready_bg_img:
-            screen.blit(pygame.transform.smoothscale(ready_bg_img, (sw, sh)), (0, 0))
+            screen.blit(get_scaled(ready_bg_img, (sw, sh)), (0, 0))
         else:
             screen.fill(DARK_GRAY)
         
@@ -337,7 +420,7 @@ def draw_game_screen(sw, sh, shake_offsets):
         avatar_x_1, avatar_y_1 = sw * 0.22, sh * 0.60
         
         if avatar1_img:
-            scaled_avatar_1 = pygame.transform.smoothscale(avatar1_img, (avatar_size_1, avatar_size_1))
+            scaled_avatar_1 = get_scaled(avatar1_img, (avatar_size_1, avatar_size_1))
             avatar_pos_1 = (avatar_x_1 - avatar_size_1 / 2, avatar_y_1 - avatar_size_1 / 2)
             screen.blit(scaled_avatar_1, avatar_pos_1)
             if player_id == 1:
@@ -354,7 +437,7 @@ def draw_game_screen(sw, sh, shake_offsets):
         avatar_x_0, avatar_y_0 = sw * 0.75, sh * 0.35
 
         if avatar0_img:
-            scaled_avatar_0 = pygame.transform.smoothscale(avatar0_img, (avatar_size_0, avatar_size_0))
+            scaled_avatar_0 = get_scaled(avatar0_img, (avatar_size_0, avatar_size_0))
             avatar_pos_0 = (avatar_x_0 - avatar_size_0 / 2, avatar_y_0 - avatar_size_0 / 2)
             screen.blit(scaled_avatar_0, avatar_pos_0)
             if player_id == 0:
@@ -368,24 +451,22 @@ def draw_game_screen(sw, sh, shake_offsets):
         
         return
 
-    bg = player_1_background if player_id == 1 else player_0_background
-    if bg: screen.blit(pygame.transform.scale(bg, (sw, sh)), (0, 0))
+    bg = get_image('player1screen_bg.png') if player_id == 1 else get_image('player2screen_bg.png')
+    if bg: screen.blit(get_scaled(bg, (sw, sh), smooth=False), (0, 0))
     else: screen.fill(DARK_GRAY)
 
     if game_over:
-        end_bg = win_screen_img if local_player_won else lose_screen_img
-        if end_bg: screen.blit(pygame.transform.scale(end_bg, (sw, sh)), (0, 0))
+        end_bg = get_image('win_screen.png') if local_player_won else get_image('lose_screen.png')
+        if end_bg: screen.blit(get_scaled(end_bg, (sw, sh), smooth=False), (0, 0))
         else: screen.fill(DARK_GRAY)
         
         end_text_str = "YOU WIN!" if local_player_won else "GAME OVER!"
         end_text_color = WHITE if local_player_won else GAME_OVER_RED
-        text_surface = font_end_screen.render(end_text_str, True, end_text_color)
-        scaled_width = int(text_surface.get_width() * end_screen_text_scale)
-        scaled_height = int(text_surface.get_height() * end_screen_text_scale)
+        text_width, text_height = font_end_screen.size(end_text_str)
+        scaled_width = int(text_width * end_screen_text_scale)
+        scaled_height = int(text_height * end_screen_text_scale)
         if scaled_width > 0 and scaled_height > 0:
-            scaled_text = pygame.transform.smoothscale(text_surface, (scaled_width, scaled_height))
-            text_rect = scaled_text.get_rect(center=(sw / 2, sh / 2))
-            draw_text_with_shadow(end_text_str, pygame.font.Font(font_name, scaled_height), end_text_color, text_rect.centerx, text_rect.centery)
+            draw_text_with_shadow(end_text_str, get_font(scaled_height), end_text_color, sw / 2, sh / 2)
         return
 
     is_large_screen = sw > 950 or sh > 650
@@ -404,8 +485,8 @@ def draw_game_screen(sw, sh, shake_offsets):
         your_name = player_names.get(player_id, "")
         draw_text_with_shadow(f"YOU ARE: {your_name.upper()}", font_medium, WHITE, sw / 2, player_info_y)
     
-    draw_hp_bar(player_hps.get(1, 0), INITIAL_HP, sw / 2 - hp_bar_width - 20, hp_bar_y, hp_bar_width, hp_bar_height, player_names.get(1, "Player 1"), shake_offsets[1])
-    draw_hp_bar(player_hps.get(0, 0), INITIAL_HP, sw / 2 + 20, hp_bar_y, hp_bar_width, hp_bar_height, player_names.get(0, "Player 0"), shake_offsets[0])
+    hp_bar_rects[1] = draw_hp_bar(player_hps.get(1, 0), INITIAL_HP, sw / 2 - hp_bar_width - 20, hp_bar_y, hp_bar_width, hp_bar_height, player_names.get(1, "Player 1"), shake_offsets[1])
+    hp_bar_rects[0] = draw_hp_bar(player_hps.get(0, 0), INITIAL_HP, sw / 2 + 20, hp_bar_y, hp_bar_width, hp_bar_height, player_names.get(0, "Player 0"), shake_offsets[0])
     
     content_start_y = hp_bar_y + hp_bar_height + (35 * (sh/SCREEN_HEIGHT))
     
@@ -452,97 +533,175 @@ def send_message(message_type, data):
     global connected_to_server
     if not connected_to_server: return
     try:
-        pickled_data = pickle.dumps({"type": message_type, "data": data})
-        client_socket.sendall(f"{len(pickled_data):<{HEADER_LENGTH}}".encode('utf-8') + pickled_data)
+        client_socket.sendall(protocol.encode_message(message_type, data))
     except socket.error as e:
         print(f"Failed to send message: {e}")
         connected_to_server = False
 
+def connect():
+    """Opens a fresh connection to the server and starts the receive thread for it."""
+    global client_socket, connected_to_server, receive_thread
+    try:
+        client_socket = socket.create_connection((SERVER_HOST, SERVER_PORT), timeout=CONNECT_TIMEOUT)
+    except socket.error:
+        return False
+    client_socket.settimeout(None)
+    connected_to_server = True
+    receive_thread = threading.Thread(target=receive_messages, daemon=True)
+    receive_thread.start()
+    return True
+
+def join_match(name):
+    """Asks the server for a match. A lobby connection the server closed (say, for idling on
+    the name screen) has no match to resume, so a fresh one is opened first."""
+    global game_message
+    if not connected_to_server and (receive_thread is None or not receive_thread.is_alive()) and not connect():
+        game_message = "Could not connect to server."
+        return False
+    send_message("ready", {"username": name, "no_pauses": False})
+    return True
+
+def reconnect():
+    """Opens a new connection after a drop and asks the server to resume our match."""
+    global client_socket, connected_to_server
+    network_updates.put(("player_update", MappingProxyType({"message": "Connection lost. Reconnecting..."})))
+    pygame.event.post(pygame.event.Event(NETWORK_EVENT))
+    client_socket.close()
+    for _ in range(RECONNECT_ATTEMPTS):
+        time.sleep(RECONNECT_DELAY)
+        try:
+            client_socket = socket.create_connection((SERVER_HOST, SERVER_PORT), timeout=RECONNECT_DELAY)
+        except socket.error:
+            continue
+        client_socket.settimeout(None)
+        connected_to_server = True
+        send_message("resume", {"token": resume_token})
+        return True
+    network_updates.put(("player_update", MappingProxyType({"message": "Could not reconnect to server."})))
+    pygame.event.post(pygame.event.Event(NETWORK_EVENT))
+    return False
+
 def receive_messages():
-    global player_id, game_message, player_hps, round_status, game_over, player_hand, connected_to_server
-    global revealed_player_card_data, revealed_opponent_card_data, local_player_won, end_screen_animation_active, end_screen_text_velocity, player_names, username, last_known_hps, end_screen_text_scale
-    full_msg, new_msg = b'', True
+    """Network thread: decodes frames into read-only updates on network_updates and wakes the
+    render loop. It never writes game state; game_loop applies the updates between frames."""
+    global connected_to_server, resume_token
+    decoder = protocol.FrameDecoder()
+    synced_state, last_seq = {}, None
     while connected_to_server:
         try:
-            chunk = client_socket.recv(4096)
-            if not chunk: connected_to_server = False; break
-            full_msg += chunk
-            while True:
-                if new_msg:
-                    if len(full_msg) < HEADER_LENGTH: break
-                    msg_len = int(full_msg[:HEADER_LENGTH]); new_msg = False
-                if len(full_msg) - HEADER_LENGTH < msg_len: break
+            if decoder.recv_into(client_socket) == 0: raise ConnectionResetError("Server closed the connection.")
+            for msg_type, msg_data in decoder.frames():
+                # Snapshots replace the synced state and deltas are merged into it; either is then
+                # handled like the game_state or round_result it stands for.
+                if msg_type == "state_snapshot":
+                    synced_state, last_seq = dict(msg_data["fields"]), msg_data["seq"]
+                    msg_type, msg_data = msg_data["kind"], dict(synced_state)
+                elif msg_type == "state_delta":
+                    if last_seq is None or msg_data["seq"] != (last_seq + 1) & protocol.SEQ_MASK:
+                        if last_seq is not None: send_message("resync", {})
+                        last_seq = None
+                        continue
+                    synced_state.update(msg_data["fields"])
+                    msg_type, msg_data, last_seq = msg_data["kind"], dict(synced_state), msg_data["seq"]
+                elif msg_type == "player_id":
+                    resume_token = msg_data["token"]
+                elif msg_type == "ping":
+                    send_message("pong", {})
+                    continue
+                network_updates.put((msg_type, MappingProxyType(msg_data)))
+            pygame.event.post(pygame.event.Event(NETWORK_EVENT))
                 
-                data_object = pickle.loads(full_msg[HEADER_LENGTH : HEADER_LENGTH + msg_len])
-                msg_type, msg_data = data_object.get("type"), data_object.get("data")
-                
-                if msg_type == "player_id":
-                    player_id = msg_data["id"]
-                elif msg_type == "player_update":
-                    game_message = msg_data["message"]
-                    if "usernames" in msg_data: player_names = msg_data["usernames"]
-                elif msg_type == "game_state":
-                    game_message, player_hps, round_status = msg_data["message"], msg_data["hps"], msg_data["round_status"]
-                    if "usernames" in msg_data: player_names = msg_data["usernames"]
-                    
-                    if round_status == "entering_username": 
-                        username = ""
-                        game_over = False 
-                        end_screen_animation_active = False
-                    
-                    player_hand = [dict(card, current_scale=NORMAL_SCALE, current_tilt=0) for card in msg_data.get("player_hand", [])]
-                    if round_status in ["waiting_for_choices", "waiting_for_players"]:
-                        player_choice, revealed_player_card_data, revealed_opponent_card_data = None, None, None
-                
-                elif msg_type == "round_result":
-                    new_hps = msg_data["hps"]
-                    for p_id_key in range(2):
-                        if new_hps.get(p_id_key, INITIAL_HP) < last_known_hps.get(p_id_key, INITIAL_HP):
-                            hp_shake_info[p_id_key]["is_shaking"] = True
-                            hp_shake_info[p_id_key]["duration"] = 15
-                    last_known_hps = new_hps.copy()
-                    
-                    player_hps, round_status, game_over = msg_data["hps"], msg_data["round_status"], msg_data.get("game_over", False)
-                    if "usernames" in msg_data: player_names = msg_data["usernames"]
-                    game_message = msg_data["message"] 
-                    
-                    if game_over and not end_screen_animation_active:
-                        if player_id is not None:
-                            win_string = f"{player_names.get(player_id)} wins the game!"
-                            local_player_won = win_string in game_message
-                        
-                        end_screen_text_scale = 0.0
-                        end_screen_text_velocity = 0.0
-                        end_screen_animation_active = True
-                        
-                    revealed_player_card_data = msg_data["player0_choice"] if player_id == 0 else msg_data["player1_choice"]
-                    revealed_opponent_card_data = msg_data["player1_choice"] if player_id == 0 else msg_data["player0_choice"]
-                
-                full_msg = full_msg[HEADER_LENGTH + msg_len:]; new_msg = True
-                if not full_msg: break
-        except (socket.error, pickle.UnpicklingError, EOFError, ValueError, IndexError) as e:
+        except (socket.error, protocol.ProtocolError, ValueError, IndexError) as e:
             print(f"Error in receive thread: {e}")
-            connected_to_server = False; break
+            connected_to_server = False
+            if resume_token is None:
+                network_updates.put(("player_update", MappingProxyType({"message": "Disconnected from server. Press JOIN to reconnect."})))
+                pygame.event.post(pygame.event.Event(NETWORK_EVENT))
+                break
+            if not reconnect(): break
+            decoder, last_seq = protocol.FrameDecoder(), None
+
+def drain_network_updates():
+    """Applies every update the receive thread has queued. Called once per frame, before anything
+    reads game state, so a frame always sees whole messages. Returns True if anything changed."""
+    applied = False
+    while True:
+        try:
+            msg_type, msg_data = network_updates.get_nowait()
+        except queue.Empty:
+            return applied
+        apply_server_message(msg_type, msg_data)
+        applied = True
+
+def apply_server_message(msg_type, msg_data):
+    global player_id, game_message, player_hps, round_status, game_over, player_hand
+    global revealed_player_card_data, revealed_opponent_card_data, local_player_won, end_screen_animation_active, end_screen_text_velocity, player_names, username, last_known_hps, end_screen_text_scale
+    global resume_token
+    if msg_type == "player_id":
+        player_id = msg_data["id"]
+    elif msg_type == "player_update":
+        game_message = msg_data["message"]
+        if "usernames" in msg_data: player_names = msg_data["usernames"]
+    elif msg_type == "game_state":
+        game_message, player_hps, round_status = msg_data["message"], msg_data["hps"], msg_data["round_status"]
+        if "usernames" in msg_data: player_names = msg_data["usernames"]
+        
+        if round_status == "entering_username": 
+            resume_token = None   # the match is over; an idle lobby connection has nothing to resume
+            username = ""
+            game_over = False 
+            end_screen_animation_active = False
+        
+        player_hand = [dict(card, current_scale=NORMAL_SCALE, current_tilt=0) for card in msg_data.get("player_hand", [])]
+        if round_status in ["waiting_for_choices", "waiting_for_players"]:
+            player_choice, revealed_player_card_data, revealed_opponent_card_data = None, None, None
+    
+    elif msg_type == "round_result":
+        new_hps = msg_data["hps"]
+        for p_id_key in range(2):
+            if new_hps.get(p_id_key, INITIAL_HP) < last_known_hps.get(p_id_key, INITIAL_HP):
+                hp_shake_info[p_id_key]["is_shaking"] = True
+                hp_shake_info[p_id_key]["duration"] = 15
+        last_known_hps = new_hps.copy()
+        
+        player_hps, round_status, game_over = msg_data["hps"], msg_data["round_status"], msg_data.get("game_over", False)
+        if "usernames" in msg_data: player_names = msg_data["usernames"]
+        game_message = msg_data["message"] 
+        
+        if game_over and not end_screen_animation_active:
+            if player_id is not None:
+                win_string = f"{player_names.get(player_id)} wins the game!"
+                local_player_won = win_string in game_message
+            
+            end_screen_text_scale = 0.0
+            end_screen_text_velocity = 0.0
+            end_screen_animation_active = True
+            
+        revealed_player_card_data = msg_data["player0_choice"] if player_id == 0 else msg_data["player1_choice"]
+        revealed_opponent_card_data = msg_data["player1_choice"] if player_id == 0 else msg_data["player0_choice"]
 
 def game_loop():
     global connected_to_server, player_choice, round_status, game_message, game_over, end_screen_text_scale, end_screen_text_velocity
-    global screen, fullscreen, username, input_box_active
-    try:
-        client_socket.connect((SERVER_HOST, SERVER_PORT))
-        connected_to_server = True
-        threading.Thread(target=receive_messages, daemon=True).start()
-    except socket.error as e:
-        game_message = "Could not connect to server."; connected_to_server = False
+    global screen, fullscreen, username, input_box_active, resume_token
+    if not connect():
+        game_message = "Could not connect to server."
     
     running, clock = True, pygame.time.Clock()
     shake_offsets = {0: (0, 0), 1: (0, 0)}
+    scene_dirty, last_blink_phase, last_hovered_button, woken_by = True, None, None, []
     
     while running:
         sw, sh = screen.get_width(), screen.get_height()
         mouse_pos = pygame.mouse.get_pos()
+        animating, dirty_rects = not DIRTY_RENDERING, []
+        if drain_network_updates():
+            scene_dirty = True
         
         for p_id, info in hp_shake_info.items():
             if info["is_shaking"]:
+                animating = True
+                if hp_bar_rects.get(p_id):
+                    dirty_rects.append(hp_bar_rects[p_id].inflate(4 * info["intensity"], 4 * info["intensity"]))
                 if info["duration"] > 0:
                     info["duration"] -= 1
                     dx = random.randint(-info["intensity"], info["intensity"])
@@ -556,21 +715,39 @@ def game_loop():
             target_scale = 1.0; force = (target_scale - end_screen_text_scale) * spring
             end_screen_text_velocity = (end_screen_text_velocity + force) * damping
             end_screen_text_scale += end_screen_text_velocity
+            if abs(end_screen_text_velocity) > ANIMATION_EPSILON or abs(target_scale - end_screen_text_scale) > ANIMATION_EPSILON:
+                animating = scene_dirty = True
             
         for card_data in player_hand:
             is_hovered = "rect" in card_data and card_data.get("rect") and card_data["rect"].collidepoint(mouse_pos)
             target_scale = HOVER_SCALE if is_hovered or player_choice == card_data else NORMAL_SCALE
             target_tilt = TILT_ANGLE if player_choice == card_data else 0
+            if abs(target_scale - card_data["current_scale"]) < ANIMATION_EPSILON and abs(target_tilt - card_data["current_tilt"]) < ANIMATION_EPSILON:
+                continue
             card_data["current_scale"] += (target_scale - card_data["current_scale"]) * SCALE_SPEED
             card_data["current_tilt"] += (target_tilt - card_data["current_tilt"]) * TILT_SPEED
+            animating = True
+            if card_data.get("rect"):
+                # Leave room for the hover growth, the selection border and the tilt.
+                card_rect = card_data["rect"]
+                dirty_rects.append(card_rect.inflate(card_rect.width * 0.3 + 20, card_rect.height * 0.3 + 20))
+
+        if round_status == "entering_username" and input_box_active:
+            blink_phase = int(time.time() * 2)
+            if blink_phase != last_blink_phase:
+                last_blink_phase, scene_dirty = blink_phase, True
             
-        for event in pygame.event.get():
+        for event in woken_by + pygame.event.get():
+            if event.type in REDRAW_EVENTS:
+                scene_dirty = True
             if event.type == pygame.QUIT: running = False
             if event.type == pygame.VIDEORESIZE:
                 if not fullscreen: screen = pygame.display.set_mode(event.size, pygame.RESIZABLE)
+                scaled_surface_cache.clear()
             if event.type == pygame.KEYDOWN and event.key == pygame.K_F11:
                 fullscreen = not fullscreen
                 screen = pygame.display.set_mode((0, 0) if fullscreen else (SCREEN_WIDTH, SCREEN_HEIGHT), pygame.FULLSCREEN if fullscreen else pygame.RESIZABLE)
+                scaled_surface_cache.clear()
             
             if round_status == "entering_username":
                 if event.type == pygame.MOUSEBUTTONDOWN:
@@ -580,13 +757,11 @@ def game_loop():
                     
                     input_box_active = input_click_rect.collidepoint(event.pos)
 
-                    if join_button_rect.collidepoint(event.pos) and len(username.strip()) > 0:
-                        send_message("ready", {"username": username.strip()})
+                    if join_button_rect.collidepoint(event.pos) and len(username.strip()) > 0 and join_match(username.strip()):
                         round_status = "waiting_for_players"
                 if event.type == pygame.KEYDOWN and input_box_active:
                     if event.key == pygame.K_RETURN and len(username.strip()) > 0:
-                        send_message("ready", {"username": username.strip()})
-                        round_status = "waiting_for_players"
+                        if join_match(username.strip()): round_status = "waiting_for_players"
                     elif event.key == pygame.K_BACKSPACE:
                         username = username[:-1]
                     elif font_large.size(username)[0] < 380: 
@@ -599,14 +774,38 @@ def game_loop():
                         continue 
                     
                     if round_status == "waiting_for_choices":
-                        for card in player_hand:
+                        for index, card in enumerate(player_hand):
                             if "rect" in card and card["rect"] and card["rect"].collidepoint(mouse_pos):
-                                player_choice = card; send_message("choice", {"choice": card}); round_status = "choice_made"; game_message = "Choice locked in! Waiting..."; break
+                                player_choice = card; send_message("choice", {"index": index}); round_status = "choice_made"; game_message = "Choice locked in! Waiting..."; break
         
-        draw_game_screen(sw, sh, shake_offsets) 
-        pygame.display.flip()
-        clock.tick(60)
+        hover_pos = pygame.mouse.get_pos()
+        hovered_button = next((text for text, rect in button_rects.items() if rect.collidepoint(hover_pos)), None)
+        if hovered_button != last_hovered_button:
+            last_hovered_button, scene_dirty = hovered_button, True
+
+        drawn = scene_dirty or not DIRTY_RENDERING or bool(dirty_rects)
+        if scene_dirty or not DIRTY_RENDERING:
+            scene_dirty = False
+            button_rects.clear()
+            draw_game_screen(sw, sh, shake_offsets)
+            pygame.display.flip()
+        elif dirty_rects:
+            area = dirty_rects[0].unionall(dirty_rects[1:]).clip(screen.get_rect())
+            screen.set_clip(area)
+            draw_game_screen(sw, sh, shake_offsets)
+            screen.set_clip(None)
+            pygame.display.update(area)
+
+        woken_by = []
+        if animating or drawn:
+            clock.tick(60)
+        else:
+            # Keep the event that woke us so it is handled first, in order, next iteration.
+            event = pygame.event.wait(IDLE_WAIT_MS)
+            if event.type != pygame.NOEVENT:
+                woken_by = [event]
         
+    resume_token = None   # the receive thread must not reconnect once we quit
     if connected_to_server: client_socket.close()
     pygame.quit()
     sys.exit()
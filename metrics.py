@@ -0,0 +1,127 @@
+"""In-process counters and latency histograms for the server's hot path.
+
+Recording is a dict increment or a bisect into fixed buckets, cheap
+enough to leave on in production. Read the numbers with a periodic dump
+to stdout or over the local stats endpoint:
+
+    curl http://127.0.0.1:65433/
+"""
+import asyncio
+import bisect
+import functools
+import json
+import time
+from collections import defaultdict
+
+# Bucket upper bounds: 1 us .. ~16 s for latencies, 1 .. 4096 for queue depths.
+LATENCY_BOUNDS = [1e-6 * 2 ** i for i in range(25)]
+DEPTH_BOUNDS = [2 ** i for i in range(13)]
+
+counters = defaultdict(int)
+histograms = {}
+started_at = time.time()
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations, capped at the largest one seen."""
+        if not self.count:
+            return 0.0
+        rank, seen = fraction * self.count, 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+def incr(name, amount=1):
+    counters[name] += amount
+
+def observe(name, value, bounds=LATENCY_BOUNDS):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram(bounds)
+    histogram.observe(value)
+
+def timed(name):
+    """Decorator recording each call's wall time in the named latency histogram."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def snapshot():
+    return {
+        "uptime": time.time() - started_at,
+        "counters": dict(sorted(counters.items())),
+        "histograms": {name: histograms[name].summary() for name in sorted(histograms)},
+    }
+
+def format_report():
+    lines = [f"--- stats after {time.time() - started_at:.0f}s ---"]
+    for name, value in sorted(counters.items()):
+        lines.append(f"{name:<40} {value}")
+    for name in sorted(histograms):
+        s = histograms[name].summary()
+        lines.append(f"{name:<40} n={s['count']} mean={s['mean']:.6g} p50={s['p50']:.6g} p99={s['p99']:.6g} max={s['max']:.6g}")
+    return "\n".join(lines)
+
+
+async def dump_periodically(interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(format_report())
+
+async def watch_loop_lag(interval=0.1):
+    """Records how late the event loop wakes a sleeping task, i.e. time spent queued behind other work."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        observe("loop_lag_seconds", max(0.0, loop.time() - expected))
+
+async def _handle_stats_request(reader, writer):
+    try:
+        await reader.read(4096)
+        body = json.dumps(snapshot(), indent=2).encode("utf-8")
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n"
+                     + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+        await writer.drain()
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_stats(host, port):
+    """Serves snapshot() as JSON to any local HTTP request."""
+    return await asyncio.start_server(_handle_stats_request, host, port)
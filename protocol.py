@@ -0,0 +1,312 @@
+"""Binary wire protocol shared by the server and the game clients.
+
+Every frame is a fixed header followed by a payload laid out by the schema
+of its message type:
+
+    version (u8) | message type (u8) | payload length (u32, network order)
+
+Message types, round statuses and cards travel as small integer codes.
+A card id is the card's index in rules.ALL_POSSIBLE_CARDS, so a card added
+there needs no change here. The server keeps hands as card ids and a
+choice names only a position in the dealt hand.
+
+game_state and round_result are sent as sequenced state frames. A
+state_snapshot carries a sequence number, the message type it stands for and
+every STATE_FIELD the server has sent so far; after that, state_delta frames
+carry the next sequence number, the message type and only the fields that
+changed. A client that sees a gap in the sequence sends resync and gets a
+new snapshot.
+"""
+import struct
+
+import rules
+
+PROTOCOL_VERSION = 8
+HEADER = struct.Struct("!BBI")
+HEADER_LENGTH = HEADER.size
+
+MESSAGE_TYPES = ["player_id", "ready", "choice", "insta_win", "player_update", "game_state", "round_result", "error",
+                 "state_delta", "resync", "resume", "state_snapshot", "spectate", "ping", "pong"]
+MESSAGE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+# The only messages a client may send; a server decoder rejects anything else at the header.
+CLIENT_MESSAGES = {"ready", "choice", "insta_win", "resync", "resume", "spectate", "pong"}
+MAX_PAYLOAD = 65536   # default largest payload a FrameDecoder accepts
+
+CARDS = rules.ALL_POSSIBLE_CARDS
+
+ROUND_STATUSES = ["entering_username", "waiting_for_players", "waiting_for_choices", "choice_made", "round_over", "game_over"]
+ROUND_STATUS_CODES = {name: code for code, name in enumerate(ROUND_STATUSES)}
+
+SCHEMAS = {
+    "player_id": [("id", "u8"), ("token", "str")],
+    "ready": [("username", "str"), ("no_pauses", "bool")],   # no_pauses asks for a room without round pauses
+    "choice": [("index", "u8")],   # position in the hand the server dealt
+    "insta_win": [],
+    "player_update": [("message", "str"), ("usernames", "names")],
+    "game_state": [("message", "str"), ("hps", "hps"), ("round_status", "status"), ("player_hand", "cards"), ("usernames", "names")],
+    "round_result": [("message", "str"), ("player0_choice", "card"), ("player1_choice", "card"), ("rps_winner", "i8"),
+                     ("hps", "hps"), ("round_status", "status"), ("game_over", "bool"), ("usernames", "names")],
+    "error": [("message", "str")],
+    "state_delta": [("seq", "u32"), ("kind", "type"), ("fields", "delta")],
+    "resync": [],
+    "resume": [("token", "str")],
+    "state_snapshot": [("seq", "u32"), ("kind", "type"), ("fields", "delta")],
+    "spectate": [("room_id", "u32")],
+    "ping": [],   # heartbeat from the server; a client answers with pong
+    "pong": [],
+}
+# Every field a game_state or round_result can carry; a delta's bit mask follows this order.
+STATE_FIELDS = [("message", "str"), ("hps", "hps"), ("round_status", "status"), ("player_hand", "cards"), ("usernames", "names"),
+                ("player0_choice", "card"), ("player1_choice", "card"), ("rps_winner", "i8"), ("game_over", "bool")]
+SEQ_MASK = 0xFFFFFFFF
+
+
+class ProtocolError(ValueError):
+    """Raised for frames that do not follow the wire protocol."""
+
+
+def card_id(card):
+    try:
+        return rules.CARD_IDS[(card["rps_value"], card["effect"])]
+    except KeyError:
+        raise ProtocolError(f"Unknown card {card}") from None
+
+def card_from_id(cid):
+    if not 0 <= cid < len(CARDS):
+        raise ProtocolError(f"Unknown card id {cid}")
+    return dict(CARDS[cid])
+
+
+# --- Field Codecs ---
+_U8 = struct.Struct("!B")
+_I8 = struct.Struct("!b")
+_U16 = struct.Struct("!H")
+_U32 = struct.Struct("!I")
+_HPS = struct.Struct("!HH")
+
+def _put_str(out, value):
+    data = value.encode("utf-8")
+    out += _U16.pack(len(data))
+    out += data
+
+def _get_str(buf, pos):
+    (length,) = _U16.unpack_from(buf, pos)
+    pos += _U16.size
+    if pos + length > len(buf):
+        raise ProtocolError("String runs past end of payload")
+    return bytes(buf[pos:pos + length]).decode("utf-8"), pos + length
+
+def _put_cards(out, cards):
+    out += _U8.pack(len(cards))
+    out += bytes(card_id(card) for card in cards)
+
+def _get_cards(buf, pos):
+    (count,) = _U8.unpack_from(buf, pos)
+    pos += _U8.size
+    if pos + count > len(buf):
+        raise ProtocolError("Card list runs past end of payload")
+    return [card_from_id(cid) for cid in buf[pos:pos + count]], pos + count
+
+def _put_names(out, names):
+    _put_str(out, names[0])
+    _put_str(out, names[1])
+
+def _get_names(buf, pos):
+    name0, pos = _get_str(buf, pos)
+    name1, pos = _get_str(buf, pos)
+    return {0: name0, 1: name1}, pos
+
+def _put_u8(out, value):
+    out += _U8.pack(value)
+
+def _get_u8(buf, pos):
+    return _U8.unpack_from(buf, pos)[0], pos + _U8.size
+
+def _put_i8(out, value):
+    out += _I8.pack(value)
+
+def _get_i8(buf, pos):
+    return _I8.unpack_from(buf, pos)[0], pos + _I8.size
+
+def _put_bool(out, value):
+    out += _U8.pack(1 if value else 0)
+
+def _get_bool(buf, pos):
+    value, pos = _get_u8(buf, pos)
+    return bool(value), pos
+
+def _put_card(out, card):
+    out += _U8.pack(card_id(card))
+
+def _get_card(buf, pos):
+    cid, pos = _get_u8(buf, pos)
+    return card_from_id(cid), pos
+
+def _put_status(out, status):
+    out += _U8.pack(ROUND_STATUS_CODES[status])
+
+def _get_status(buf, pos):
+    code, pos = _get_u8(buf, pos)
+    if code >= len(ROUND_STATUSES):
+        raise ProtocolError(f"Unknown round status {code}")
+    return ROUND_STATUSES[code], pos
+
+def _put_hps(out, hps):
+    out += _HPS.pack(hps[0], hps[1])
+
+def _get_hps(buf, pos):
+    hp0, hp1 = _HPS.unpack_from(buf, pos)
+    return {0: hp0, 1: hp1}, pos + _HPS.size
+
+def _put_u32(out, value):
+    out += _U32.pack(value)
+
+def _get_u32(buf, pos):
+    return _U32.unpack_from(buf, pos)[0], pos + _U32.size
+
+def _put_type(out, msg_type):
+    out += _U8.pack(MESSAGE_CODES[msg_type])
+
+def _get_type(buf, pos):
+    code, pos = _get_u8(buf, pos)
+    if code >= len(MESSAGE_TYPES):
+        raise ProtocolError(f"Unknown message type {code}")
+    return MESSAGE_TYPES[code], pos
+
+def _put_delta(out, fields):
+    mask = 0
+    for bit, (name, _) in enumerate(STATE_FIELDS):
+        if name in fields:
+            mask |= 1 << bit
+    out += _U16.pack(mask)
+    for name, kind in STATE_FIELDS:
+        if name in fields:
+            FIELD_CODECS[kind][0](out, fields[name])
+
+def _get_delta(buf, pos):
+    (mask,) = _U16.unpack_from(buf, pos)
+    pos += _U16.size
+    fields = {}
+    for bit, (name, kind) in enumerate(STATE_FIELDS):
+        if mask & (1 << bit):
+            fields[name], pos = FIELD_CODECS[kind][1](buf, pos)
+    return fields, pos
+
+FIELD_CODECS = {
+    "u8": (_put_u8, _get_u8),
+    "i8": (_put_i8, _get_i8),
+    "bool": (_put_bool, _get_bool),
+    "str": (_put_str, _get_str),
+    "card": (_put_card, _get_card),
+    "cards": (_put_cards, _get_cards),
+    "names": (_put_names, _get_names),
+    "hps": (_put_hps, _get_hps),
+    "status": (_put_status, _get_status),
+    "u32": (_put_u32, _get_u32),
+    "type": (_put_type, _get_type),
+    "delta": (_put_delta, _get_delta),
+}
+
+
+# --- Messages ---
+def encode_message(msg_type, data):
+    """Encodes a message into one complete frame (header + payload)."""
+    out = bytearray(HEADER_LENGTH)
+    for name, kind in SCHEMAS[msg_type]:
+        FIELD_CODECS[kind][0](out, data[name])
+    HEADER.pack_into(out, 0, PROTOCOL_VERSION, MESSAGE_CODES[msg_type], len(out) - HEADER_LENGTH)
+    return bytes(out)
+
+def parse_header(buf, pos=0):
+    """Returns (message code, payload length) for the header at buf[pos:]."""
+    version, code, length = HEADER.unpack_from(buf, pos)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if code >= len(MESSAGE_TYPES):
+        raise ProtocolError(f"Unknown message type {code}")
+    return code, length
+
+def decode_payload(code, payload):
+    """Decodes a payload into (message type, data dict)."""
+    msg_type = MESSAGE_TYPES[code]
+    data, pos = {}, 0
+    try:
+        for name, kind in SCHEMAS[msg_type]:
+            data[name], pos = FIELD_CODECS[kind][1](payload, pos)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError(f"Malformed {msg_type} payload: {e}") from e
+    if pos != len(payload):
+        raise ProtocolError(f"Trailing bytes after {msg_type} payload")
+    return msg_type, data
+
+
+# --- Framing ---
+class FrameDecoder:
+    """Incremental frame parser over one reusable receive buffer.
+
+    Bytes are received straight into the free tail of the buffer (recv_into)
+    and complete frames are decoded in place through a read cursor, so each
+    received byte is copied at most once more, when a partial frame is moved
+    back to the front to make room.
+
+    A header is checked as soon as it arrives: a bad version, a message type
+    outside accepted or a payload longer than max_payload raises ProtocolError
+    before any of the payload is buffered, so the buffer never grows past one
+    maximum frame plus one read.
+    """
+
+    def __init__(self, capacity=65536, max_payload=MAX_PAYLOAD, accepted=None):
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._start = 0   # first byte not yet decoded
+        self._end = 0     # end of received data
+        self.max_payload = max_payload
+        self.accepted = None if accepted is None else {MESSAGE_CODES[name] for name in accepted}
+
+    def get_buffer(self, min_size=4096):
+        """Returns a writable view of at least min_size free bytes."""
+        if len(self._buf) - self._end < min_size:
+            self._make_room(min_size)
+        return self._view[self._end:]
+
+    def advance(self, nbytes):
+        """Marks nbytes written into the view from get_buffer() as received."""
+        self._end += nbytes
+
+    def recv_into(self, sock):
+        """Receives from a blocking socket into the buffer; returns 0 on EOF."""
+        nbytes = sock.recv_into(self.get_buffer())
+        self.advance(nbytes)
+        return nbytes
+
+    def feed(self, data):
+        """Appends bytes that were received elsewhere (e.g. an asyncio stream)."""
+        self.get_buffer(len(data))[:len(data)] = data
+        self.advance(len(data))
+
+    def frames(self):
+        """Yields (message type, data) for every complete frame received so far."""
+        while self._end - self._start >= HEADER_LENGTH:
+            code, length = parse_header(self._buf, self._start)
+            if length > self.max_payload:
+                raise ProtocolError(f"{MESSAGE_TYPES[code]} frame of {length} bytes exceeds the {self.max_payload} byte limit")
+            if self.accepted is not None and code not in self.accepted:
+                raise ProtocolError(f"Unexpected {MESSAGE_TYPES[code]} frame")
+            frame_end = self._start + HEADER_LENGTH + length
+            if frame_end > self._end:
+                break
+            payload = self._view[self._start + HEADER_LENGTH:frame_end]
+            self._start = frame_end
+            yield decode_payload(code, payload)
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _make_room(self, min_size):
+        pending = self._end - self._start
+        if pending + min_size > len(self._buf):
+            new_buf = bytearray(max(2 * len(self._buf), pending + min_size))
+            new_buf[:pending] = self._view[self._start:self._end]
+            self._buf, self._view = new_buf, memoryview(new_buf)
+        elif self._start:
+            self._view[:pending] = self._view[self._start:self._end]
+        self._start, self._end = 0, pending
@@ -0,0 +1,150 @@
+"""Append-only binary match log and offline replayer.
+
+The server writes one record per event to a shared log file. Every
+record starts with a record type and the match seed, which identifies the
+match:
+
+    MATCH_START  usernames, initial HP, hand size
+    ROUND        card id played by each player
+    INSTA_WIN    player who used the insta-win button
+    MATCH_END    final HP of each player (both above 0 if abandoned)
+
+The seed drives the match's own random.Random, so replaying re-deals the
+exact hands, checks that every played card was in hand, and resolves
+each round through rules.OUTCOMES:
+
+    python replay.py replays.bin            # summary
+    python replay.py replays.bin --verbose  # one line per match
+"""
+import argparse
+import random
+import struct
+import time
+
+import rules
+
+MAGIC = b"RPSLOG"
+VERSION = 1
+FILE_HEADER = struct.Struct("!6sB")
+RECORD = struct.Struct("!BQ")    # record type, match seed
+MATCH_START, ROUND, INSTA_WIN, MATCH_END = 1, 2, 3, 4
+_START = struct.Struct("!HB")    # initial hp, hand size
+_ROUND = struct.Struct("!BB")    # card id of player 0, card id of player 1
+_INSTA_WIN = struct.Struct("!B") # player id
+_END = struct.Struct("!HH")      # hp of player 0, hp of player 1
+CARD_ID_RANGE = range(rules.NUM_CARDS)
+
+
+class ReplayWriter:
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+    def _write(self, record_type, seed, payload=b""):
+        self.file.write(RECORD.pack(record_type, seed) + payload)
+
+    def match_start(self, seed, usernames, initial_hp, hand_size):
+        names = b"".join(bytes([len(name)]) + name for name in (usernames[i].encode("utf-8")[:255] for i in range(2)))
+        self._write(MATCH_START, seed, names + _START.pack(initial_hp, hand_size))
+
+    def round(self, seed, card_id0, card_id1):
+        self._write(ROUND, seed, _ROUND.pack(card_id0, card_id1))
+
+    def insta_win(self, seed, player_id):
+        self._write(INSTA_WIN, seed, _INSTA_WIN.pack(player_id))
+
+    def match_end(self, seed, hp0, hp1):
+        self._write(MATCH_END, seed, _END.pack(hp0, hp1))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_records(path):
+    """Yields (record type, seed, fields) for every record in the log."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} replay log")
+    pos = FILE_HEADER.size
+    while pos < len(data):
+        record_type, seed = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        if record_type == MATCH_START:
+            names = []
+            for _ in range(2):
+                length = data[pos]
+                names.append(data[pos + 1:pos + 1 + length].decode("utf-8", errors="replace"))
+                pos += 1 + length
+            initial_hp, hand_size = _START.unpack_from(data, pos)
+            pos += _START.size
+            yield record_type, seed, (names, initial_hp, hand_size)
+        elif record_type == ROUND:
+            yield record_type, seed, _ROUND.unpack_from(data, pos)
+            pos += _ROUND.size
+        elif record_type == INSTA_WIN:
+            yield record_type, seed, _INSTA_WIN.unpack_from(data, pos)
+            pos += _INSTA_WIN.size
+        elif record_type == MATCH_END:
+            yield record_type, seed, _END.unpack_from(data, pos)
+            pos += _END.size
+        else:
+            raise ValueError(f"Unknown record type {record_type} at offset {pos - RECORD.size}")
+
+def replay(path, outcomes=rules.OUTCOMES):
+    """Replays every match in the log through the outcome table and returns one result dict per match.
+
+    A match is "mismatched" if the replayed HP differs from the recorded end
+    (e.g. after a rule change) and "invalid" if a card was played that was not dealt."""
+    matches, results = {}, []
+    for record_type, seed, fields in read_records(path):
+        if record_type == MATCH_START:
+            names, initial_hp, hand_size = fields
+            match = matches[seed] = {"seed": seed, "usernames": names, "hp": [initial_hp, initial_hp], "rounds": 0,
+                                     "hand_size": hand_size, "rng": random.Random(seed), "invalid": False, "insta_win": False}
+            continue
+        match = matches.get(seed)
+        if match is None:
+            continue
+        if record_type == ROUND:
+            card_id0, card_id1 = fields
+            # Sampling card ids draws exactly like the server's sample of the card dicts.
+            hands = [match["rng"].sample(CARD_ID_RANGE, match["hand_size"]) for _ in range(2)]
+            if not match["insta_win"] and (card_id0 not in hands[0] or card_id1 not in hands[1]):
+                match["invalid"] = True
+            _, damage0, damage1 = outcomes[card_id0 * rules.NUM_CARDS + card_id1]
+            match["hp"] = [max(0, match["hp"][0] - damage0), max(0, match["hp"][1] - damage1)]
+            match["rounds"] += 1
+        elif record_type == INSTA_WIN:
+            match["insta_win"] = True
+            match["hp"][1 - fields[0]] = 0
+        elif record_type == MATCH_END:
+            del matches[seed]
+            match["recorded_hp"] = list(fields)
+            match["mismatched"] = match["hp"] != match["recorded_hp"]
+            del match["rng"]
+            results.append(match)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a server match log through the round resolver")
+    parser.add_argument("log")
+    parser.add_argument("--verbose", action="store_true", help="print one line per match")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = replay(args.log)
+    elapsed = time.perf_counter() - started
+    rounds = sum(match["rounds"] for match in results)
+    if args.verbose:
+        for match in results:
+            flags = " MISMATCH" if match["mismatched"] else ""
+            flags += " INVALID" if match["invalid"] else ""
+            names = match["usernames"]
+            print(f"{match['seed']:016x} {names[0]} vs {names[1]}: {match['rounds']} rounds, "
+                  f"hp {match['hp']} (recorded {match['recorded_hp']}){flags}")
+    print(f"Replayed {len(results)} matches, {rounds} rounds in {elapsed:.2f}s ({rounds / max(elapsed, 1e-9):,.0f} rounds/s)")
+    print(f"Mismatched: {sum(match['mismatched'] for match in results)}, invalid: {sum(match['invalid'] for match in results)}")
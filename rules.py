@@ -0,0 +1,63 @@
+"""Game rules: the card pool, card effects and the round outcome table.
+
+Effects are plain data read by compile_outcomes(), which works out the
+result of every pair of cards once at import time. Resolving a round is
+then a single indexed lookup, and a new effect only needs an entry in
+CARD_EFFECTS (and cards that use it in ALL_POSSIBLE_CARDS).
+"""
+
+INITIAL_HP = 100
+BASE_DAMAGE_PER_ROUND = 10
+NUM_CARDS_IN_HAND = 3
+RPS_RULES = {0: [2], 1: [0], 2: [1]}   # rps value -> values it beats
+CHOICES = {0: "Rock", 1: "Paper", 2: "Scissors"}
+
+# damage_on_win:   damage dealt to the loser when this card wins (instead of BASE_DAMAGE_PER_ROUND)
+# counter_on_loss: damage dealt back to the winner when this card loses
+# block_on_loss:   damage taken is reduced by this much when this card loses
+CARD_EFFECTS = {
+    "none": {},
+    "power_attack": {"damage_on_win": 20},
+    "counter_damage_5": {"counter_on_loss": 5},
+}
+
+# Card ids are indexes into this list (see protocol.py).
+ALL_POSSIBLE_CARDS = [
+    {"rps_value": 0, "effect": "none"},
+    {"rps_value": 1, "effect": "none"},
+    {"rps_value": 2, "effect": "none"},
+    {"rps_value": 0, "effect": "power_attack"},
+    {"rps_value": 1, "effect": "power_attack"},
+    {"rps_value": 2, "effect": "power_attack"},
+    {"rps_value": 0, "effect": "counter_damage_5"},
+    {"rps_value": 1, "effect": "counter_damage_5"},
+    {"rps_value": 2, "effect": "counter_damage_5"},
+]
+CARD_IDS = {(card["rps_value"], card["effect"]): cid for cid, card in enumerate(ALL_POSSIBLE_CARDS)}
+NUM_CARDS = len(ALL_POSSIBLE_CARDS)
+
+
+def compile_outcomes(cards=ALL_POSSIBLE_CARDS, effects=CARD_EFFECTS, base_damage=BASE_DAMAGE_PER_ROUND):
+    """Returns a flat table where entry [id0 * len(cards) + id1] is
+    (rps winner or -1 for a tie, damage to player 0, damage to player 1)."""
+    outcomes = []
+    for card0 in cards:
+        for card1 in cards:
+            if card0["rps_value"] == card1["rps_value"]:
+                outcomes.append((-1, 0, 0))
+                continue
+            winner_id = 0 if card1["rps_value"] in RPS_RULES.get(card0["rps_value"], []) else 1
+            winner_effect = effects[(card0, card1)[winner_id]["effect"]]
+            loser_effect = effects[(card0, card1)[1 - winner_id]["effect"]]
+            damage_to_loser = max(0, winner_effect.get("damage_on_win", base_damage) - loser_effect.get("block_on_loss", 0))
+            damage_to_winner = loser_effect.get("counter_on_loss", 0)
+            damage = [0, 0]
+            damage[winner_id], damage[1 - winner_id] = damage_to_winner, damage_to_loser
+            outcomes.append((winner_id, damage[0], damage[1]))
+    return outcomes
+
+OUTCOMES = compile_outcomes()
+
+def resolve_ids(card_id0, card_id1):
+    """Returns (rps winner or -1, damage to player 0, damage to player 1) for two card ids."""
+    return OUTCOMES[card_id0 * NUM_CARDS + card_id1]
@@ -1,77 +1,369 @@
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import secrets
+import signal
 import socket
-import threading
-import pickle
 import time
-import random
+from collections import OrderedDict, deque
+
+import metrics
+import protocol
+import replay
+import rules
+import stats_store
+import timers
+from rules import ALL_POSSIBLE_CARDS, INITIAL_HP, NUM_CARDS_IN_HAND
+
+CARD_ID_RANGE = range(rules.NUM_CARDS)
 
 # --- Game Config ---
 HOST = '0.0.0.0'
 PORT = 65432
-HEADER_LENGTH = 10
-RPS_RULES = {0: [2], 1: [0], 2: [1]}
-CHOICES = {0: "Rock", 1: "Paper", 2: "Scissors"}
-INITIAL_HP = 100
-BASE_DAMAGE_PER_ROUND = 10
-NUM_CARDS_IN_HAND = 3
-
-ALL_POSSIBLE_CARDS = [
-    {"rps_value": 0, "effect": "none"},
-    {"rps_value": 1, "effect": "none"},
-    {"rps_value": 2, "effect": "none"},
-    {"rps_value": 0, "effect": "power_attack"},
-    {"rps_value": 1, "effect": "power_attack"},
-    {"rps_value": 2, "effect": "power_attack"},
-    {"rps_value": 0, "effect": "counter_damage_5"},
-    {"rps_value": 1, "effect": "counter_damage_5"},
-    {"rps_value": 2, "effect": "counter_damage_5"},
-]
+# Seconds a room waits before each transition; a room may override any of them (0 = immediately).
+ROUND_PAUSES = {
+    "game_start": 1.0,      # both players ready -> first deal
+    "choice_reveal": 0.5,   # second choice locked in -> round result
+    "round_result": 5.0,    # round result shown -> next round or game reset
+}
+NO_PAUSES = {pause: 0 for pause in ROUND_PAUSES}   # rooms of players who ask for them (bots and benchmarks)
+
+# --- Room Config ---
+MAX_ROOMS = 5000
+MAX_CLIENTS = 2 * MAX_ROOMS   # connections (playing or queued) before new ones are turned away
+
+# --- Spectator Config ---
+MAX_SPECTATORS = 1000      # read-only viewers per match
+SPECTATE_ANY = 0xFFFFFFFF  # spectate room id meaning "the newest match"
+
+# --- Session Config ---
+RESUME_GRACE = 30.0   # seconds a dropped player's seat is held for them to reconnect; 0 ends the match at once
+
+# --- Sharding Config ---
+# With more than one worker, a front process runs the lobby and matchmaking and hands each
+# paired match's sockets to a worker process, so match traffic is spread across cores.
+WORKERS = 1
+SHARD_MESSAGE_SIZE = 256 * 1024   # largest front <-> worker hand-off message (usernames as JSON)
+WORKER_SHUTDOWN_TIMEOUT = 10.0    # seconds the front waits for workers to flush and exit
+
+# --- Receive Limits Config ---
+MAX_FRAME_SIZE = 1024      # largest payload a client may send; a header announcing more closes the connection
+READ_CHUNK = 4096          # bytes read per call; the stream buffers at most twice this before pausing the socket
+READ_BUDGET = 64 * 1024    # bytes per second a connection may send before reads pause (TCP pushes back); 0 disables
+
+# --- Heartbeat Config ---
+PING_INTERVAL = 15.0   # seconds a client may stay silent before it is pinged; 0 disables heartbeats
+PONG_TIMEOUT = 10.0    # seconds it then has to answer before its connection is closed
+IDLE_TIMEOUT = 600.0   # seconds a connection may sit in the lobby without doing anything; 0 disables it
+
+# --- Send Queue Config ---
+SEND_QUEUE_LIMIT = 64              # frames queued per connection before the slow-consumer policy applies
+SEND_BUFFER_HIGH_WATER = 16 * 1024 # bytes the transport may buffer before the writer waits for the peer
+SLOW_CONSUMER_POLICY = "coalesce"  # "drop_stale", "coalesce" or "disconnect"
+STATE_MESSAGES = {"player_update"}  # superseded by the next message of the same type
+STATE_FRAMES = {"state_delta", "state_snapshot"}  # shed together and replaced by one fresh snapshot
+
+# --- Stats Config ---
+STATS_HOST = '127.0.0.1'
+STATS_PORT = 65433      # local JSON stats endpoint; 0 disables it
+STATS_INTERVAL = 0      # seconds between stats dumps to stdout; 0 disables them
+
+# --- Replay Config ---
+REPLAY_LOG = None       # path of the append-only match log (see replay.py); None disables it
+
+# --- Player Stats Config ---
+STATS_DB = None         # SQLite file of per-player totals and the leaderboard (see stats_store.py); None disables it
 
 # ---  Variables ---
-clients = {}  
-player_data = {
-    0: {"username": "Player 0", "ready": False, "hp": INITIAL_HP, "choice": None, "hand": []},
-    1: {"username": "Player 1", "ready": False, "hp": INITIAL_HP, "choice": None, "hand": []}
-}
-game_started = False
-clients_lock = threading.Lock()
+rooms = {}          # room_id -> room state
+sessions = {}       # resume token -> session of a player seated in a match
+# no_pauses -> conn -> (username, time queued) of players waiting for an opponent, oldest first.
+# Players who asked for zero-pause rooms are only paired with each other.
+match_queues = {False: OrderedDict(), True: OrderedDict()}
+client_rooms = {}   # conn -> room the connection is seated in
+spectating = {}     # conn -> room the connection watches
+outboxes = {}       # conn -> outbound queue drained by the connection's writer task
+next_room_id = 0
+timer_wheel = timers.TimerWheel()
+replay_log = None   # replay.ReplayWriter when REPLAY_LOG is set
+player_stats = None # stats_store.StatsStore when STATS_DB is set
+seed_source = random.SystemRandom()
+worker_links = {}   # front: worker index -> Unix socket to that worker process, while it is alive
+worker_processes = []
+front_link = None   # worker: Unix socket to the front process
+worker_index = None # worker: its index, which prefixes its resume tokens
+next_worker = 0
+handed_off = set()  # conns whose socket was passed to another process
+
+
+def new_player_data(player_id):
+    # hand and choice are card ids; the client only ever names a position in its hand.
+    return {"username": f"Player {player_id}", "hp": INITIAL_HP, "choice": None, "hand": [],
+            "damage_dealt": 0, "card_plays": [0] * rules.NUM_CARDS}
+
+def new_room(room_id, pauses=None):
+    """Creates the state for one independent match between two players."""
+    return {
+        "id": room_id,
+        "clients": {},
+        "sessions": {},     # player_id -> session, kept while the player is away
+        "spectators": set(),
+        # One state stream shared by all spectators, so each frame is encoded once (see fan_out).
+        "spectator_view": {"seq": 0, "synced": None, "kind": None},
+        "player_data": {i: new_player_data(i) for i in range(2)},
+        "game_started": False,
+        "timer": None,
+        "seed": None,       # seed of the current match, which also identifies it in the replay log
+        "rounds": 0,        # rounds resolved in the current match
+        "rng": None,        # random.Random(seed) that deals the current match
+        "pauses": dict(ROUND_PAUSES, **(pauses or {})),
+    }
+
+
+def open_outbox(conn):
+    """Creates the bounded send queue for a connection and starts its writer task."""
+    conn.transport.set_write_buffer_limits(high=SEND_BUFFER_HIGH_WATER)
+    # "synced" is the state view the client was last sent (None until its first full snapshot).
+    outbox = {"queue": deque(), "wakeup": asyncio.Event(), "seq": 0, "synced": None, "kind": None}
+    # Heartbeat bookkeeping: when anything last arrived, when the client last did something
+    # other than answer a ping, and when the unanswered ping (if any) went out.
+    now = time.monotonic()
+    outbox.update(heard_at=now, active_at=now, ping_sent_at=None, heartbeat=None)
+    outbox["task"] = asyncio.create_task(drain_outbox(conn, outbox))
+    outboxes[conn] = outbox
+    if PING_INTERVAL > 0 or IDLE_TIMEOUT > 0:
+        outbox["heartbeat"] = timer_wheel.schedule(min(t for t in (PING_INTERVAL, IDLE_TIMEOUT) if t > 0), check_heartbeat, conn, outbox)
 
+def close_outbox(conn):
+    outbox = outboxes.pop(conn, None)
+    if outbox is not None:
+        outbox["task"].cancel()
+        if outbox["heartbeat"] is not None:
+            outbox["heartbeat"].cancel()
 
-def send_pickled(conn, data_object):
-    """Sends a pickled object with a fixed-size header."""
+async def drain_outbox(conn, outbox):
+    """Writes queued frames to the socket, waiting for the peer whenever its buffer is full."""
+    queue, wakeup = outbox["queue"], outbox["wakeup"]
     try:
-        pickled_data = pickle.dumps(data_object)
-        header = f"{len(pickled_data):<{HEADER_LENGTH}}".encode('utf-8')
-        conn.sendall(header + pickled_data)
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+            frames = [frame for _, frame in queue]
+            queue.clear()
+            metrics.incr("bytes_out", sum(map(len, frames)))
+            conn.writelines(frames)
+            await conn.drain()
     except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
-        pass
-    except Exception as e:
-        print(f"Error in send_pickled: {e}")
+        conn.transport.abort()
+
+def shed_state_frames(conn, outbox):
+    """Replaces every queued state frame with one state_snapshot of the connection's current view.
+    Returns False if no state frames were queued."""
+    queue = outbox["queue"]
+    kept = [item for item in queue if item[0] not in STATE_FRAMES]
+    if len(kept) == len(queue):
+        return False
+    # A spectator's view is its room's shared stream; a player's is the one kept in its outbox.
+    view = spectating[conn]["spectator_view"] if conn in spectating else outbox
+    metrics.incr("state_frames_shed", len(queue) - len(kept))
+    queue.clear()
+    queue.extend(kept)
+    if view["synced"] is not None:
+        queue.append(("state_snapshot", protocol.encode_message("state_snapshot", {"seq": view["seq"], "kind": view["kind"], "fields": view["synced"]})))
+    outbox["wakeup"].set()
+    return True
+
+def make_room_in_outbox(conn, outbox, message_type):
+    """Applies SLOW_CONSUMER_POLICY to a full queue. Returns False if the client was dropped."""
+    queue = outbox["queue"]
+    if SLOW_CONSUMER_POLICY == "drop_stale":
+        for i, (queued_type, _) in enumerate(queue):
+            if queued_type in STATE_MESSAGES:
+                del queue[i]
+                return True
+    elif SLOW_CONSUMER_POLICY == "coalesce" and message_type in STATE_MESSAGES:
+        kept = [item for item in queue if item[0] != message_type]
+        if len(kept) < len(queue):
+            queue.clear()
+            queue.extend(kept)
+            return True
+    if SLOW_CONSUMER_POLICY != "disconnect" and shed_state_frames(conn, outbox) and len(queue) < SEND_QUEUE_LIMIT:
+        return True
+    metrics.incr("slow_consumers_dropped")
+    print(f"Dropping slow client {conn.get_extra_info('peername')}: {len(queue)} frames queued.")
+    conn.transport.abort()
+    return False
+
+def send_frame(conn, frame, message_type=None):
+    """Queues an already encoded frame on the connection's outbox."""
+    outbox = outboxes.get(conn)
+    if outbox is None or conn.is_closing():
+        return
+    queue = outbox["queue"]
+    if len(queue) >= SEND_QUEUE_LIMIT:
+        if message_type in STATE_FRAMES and SLOW_CONSUMER_POLICY != "disconnect" and shed_state_frames(conn, outbox):
+            return   # the snapshot that replaced the queued state frames already includes this one
+        if not make_room_in_outbox(conn, outbox, message_type):
+            return
+    queue.append((message_type, frame))
+    metrics.observe("send_queue_depth", len(queue), metrics.DEPTH_BOUNDS)
+    outbox["wakeup"].set()
+
+def send_message(conn, message_type, data):
+    send_frame(conn, protocol.encode_message(message_type, data), message_type)
 
-def broadcast(message_type, data):
-    """Broadcasts a message to all connected clients using pickle."""
-    message = {"type": message_type, "data": data}
-    with clients_lock:
-        for conn in list(clients.keys()):
-            send_pickled(conn, message)
+def broadcast(room, message_type, data):
+    """Encodes a message once and sends it to all clients and spectators in a room."""
+    frame = protocol.encode_message(message_type, data)
+    for conn in list(room["clients"].keys()):
+        send_frame(conn, frame, message_type)
+    for conn in list(room["spectators"]):
+        send_frame(conn, frame, message_type)
+
+def send_state(conn, message_type, data):
+    """Sends a game_state or round_result as a state_delta of the fields that changed since the
+    connection's last state frame, or as a state_snapshot if the client has none yet."""
+    outbox = outboxes.get(conn)
+    if outbox is None:
+        return
+    outbox["seq"] = (outbox["seq"] + 1) & protocol.SEQ_MASK
+    outbox["kind"] = message_type
+    synced = outbox["synced"]
+    if synced is None:
+        outbox["synced"] = dict(data)
+        send_message(conn, "state_snapshot", {"seq": outbox["seq"], "kind": message_type, "fields": data})
+        return
+    changed = {name: value for name, value in data.items() if name not in synced or synced[name] != value}
+    synced.update(changed)
+    send_message(conn, "state_delta", {"seq": outbox["seq"], "kind": message_type, "fields": changed})
+
+def send_player_state(session, message_type, data):
+    """Sends a state message to a seated player, or folds it into their view while they are away."""
+    if session["conn"] is not None:
+        send_state(session["conn"], message_type, data)
+    else:
+        session["synced"] = dict(session["synced"] or {}, **data)
+        session["kind"] = message_type
+
+def broadcast_state(room, message_type, data):
+    for session in list(room["sessions"].values()):
+        send_player_state(session, message_type, data)
+    fan_out(room, message_type, data)
+
+def fan_out(room, message_type, data):
+    """Advances the room's spectator stream and sends the same encoded frame to every spectator.
+
+    Spectators share one sequence and view, so a delta is computed and encoded once per
+    message no matter how many are watching. Hands are never part of it."""
+    if "player_hand" in data:
+        data = dict(data, player_hand=[])
+    view = room["spectator_view"]
+    view["seq"] = (view["seq"] + 1) & protocol.SEQ_MASK
+    view["kind"] = message_type
+    if view["synced"] is None:
+        view["synced"] = dict(data)
+        frame_type, frame_data = "state_snapshot", {"seq": view["seq"], "kind": message_type, "fields": data}
+    else:
+        changed = {name: value for name, value in data.items() if name not in view["synced"] or view["synced"][name] != value}
+        view["synced"].update(changed)
+        frame_type, frame_data = "state_delta", {"seq": view["seq"], "kind": message_type, "fields": changed}
+    if not room["spectators"]:
+        return
+    frame = protocol.encode_message(frame_type, frame_data)
+    for conn in list(room["spectators"]):
+        send_frame(conn, frame, frame_type)
+
+def send_spectator_snapshot(conn, room):
+    view = room["spectator_view"]
+    if view["synced"] is not None:
+        send_message(conn, "state_snapshot", {"seq": view["seq"], "kind": view["kind"], "fields": view["synced"]})
+
+def resync(conn):
+    """Answers a client that saw a gap in the state sequence with a state_snapshot."""
+    if conn in spectating:
+        metrics.incr("state_resyncs")
+        send_spectator_snapshot(conn, spectating[conn])
+        return
+    outbox = outboxes.get(conn)
+    if outbox is None or outbox["synced"] is None:
+        return
+    metrics.incr("state_resyncs")
+    synced, outbox["synced"] = outbox["synced"], None
+    send_state(conn, outbox["kind"], synced)
+
+def schedule(room, pause, callback, *args):
+    """Runs callback(*args) once the room's named pause has elapsed, without blocking the event loop.
+
+    A room has at most one pending transition; scheduling a new one replaces it."""
+    cancel_timer(room)
+    room["timer"] = timer_wheel.schedule(room["pauses"][pause], callback, *args)
+
+def cancel_timer(room):
+    if room["timer"] is not None:
+        room["timer"].cancel()
+        room["timer"] = None
+
+def usernames(room):
+    return {i: room["player_data"][i]["username"] for i in range(2)}
+
+def hps(room):
+    return {i: room["player_data"][i]["hp"] for i in range(2)}
+
+def hand_cards(hand):
+    return [ALL_POSSIBLE_CARDS[cid] for cid in hand]
 
 # Logic Function
-def deal_cards():
-    """Deals a new hand of cards to each player."""
+def deal_cards(room):
+    """Deals a new hand of cards to each player in the room."""
     for i in range(2):
-        player_data[i]["hand"] = random.sample(ALL_POSSIBLE_CARDS, NUM_CARDS_IN_HAND)
+        room["player_data"][i]["hand"] = room["rng"].sample(CARD_ID_RANGE, NUM_CARDS_IN_HAND)
 
-def process_round_end():
-    """Processes the round end, applying game logic."""
-    global game_started
+def begin_match(room):
+    """Seeds the room's dealer for a new match and logs its start."""
+    room["seed"] = seed_source.getrandbits(64)
+    room["rng"] = random.Random(room["seed"])
+    if replay_log:
+        replay_log.match_start(room["seed"], usernames(room), INITIAL_HP, NUM_CARDS_IN_HAND)
+
+def end_match(room):
+    """Logs the final HPs of the room's match (both above 0 if it was abandoned)."""
+    if room["seed"] is not None and replay_log:
+        replay_log.match_end(room["seed"], room["player_data"][0]["hp"], room["player_data"][1]["hp"])
+    room["seed"] = None
+
+def record_player_stats(room):
+    """Queues the finished match for the stats store; the write happens on its own thread."""
+    player_data = room["player_data"]
+    players = []
+    for i in range(2):
+        me, opponent = player_data[i], player_data[1 - i]
+        result = "draw" if me["hp"] <= 0 and opponent["hp"] <= 0 else "loss" if me["hp"] <= 0 else "win"
+        players.append({"username": me["username"], "result": result, "damage_dealt": me["damage_dealt"],
+                        "damage_taken": opponent["damage_dealt"], "card_plays": me["card_plays"]})
+    player_stats.record_match(players, room["rounds"])
 
+@metrics.timed("process_round_end_seconds")
+def process_round_end(room):
+    """Processes the round end, applying game logic."""
+    player_data = room["player_data"]
     p0, p1 = player_data[0], player_data[1]
-    choice0, choice1 = p0["choice"], p1["choice"]
+    card_id0, card_id1 = p0["choice"], p1["choice"]
 
-    if not choice0 or not choice1: return
+    if card_id0 is None or card_id1 is None: return
 
-    winner_id = -1
-    if choice0["rps_value"] != choice1["rps_value"]:
-        winner_id = 0 if choice1["rps_value"] in RPS_RULES.get(choice0["rps_value"], []) else 1
+    if replay_log and room["seed"] is not None:
+        replay_log.round(room["seed"], card_id0, card_id1)
+    winner_id, *damage = rules.resolve_ids(card_id0, card_id1)
+    room["rounds"] += 1
+    p0["card_plays"][card_id0] += 1
+    p1["card_plays"][card_id1] += 1
+    p0["damage_dealt"] += damage[1]
+    p1["damage_dealt"] += damage[0]
 
     result_message = ""
     game_over = False
@@ -82,10 +374,7 @@ def process_round_end():
         loser_id = 1 - winner_id
         winner_name = player_data[winner_id]["username"]
         loser_name = player_data[loser_id]["username"]
-        winner_choice, loser_choice = player_data[winner_id]["choice"], player_data[loser_id]["choice"]
-
-        damage_to_loser = 20 if winner_choice.get("effect") == "power_attack" else BASE_DAMAGE_PER_ROUND
-        damage_to_winner = 5 if loser_choice.get("effect") == "counter_damage_5" else 0
+        damage_to_loser, damage_to_winner = damage[loser_id], damage[winner_id]
 
         player_data[loser_id]["hp"] = max(0, player_data[loser_id]["hp"] - damage_to_loser)
         player_data[winner_id]["hp"] = max(0, player_data[winner_id]["hp"] - damage_to_winner)
@@ -96,6 +385,7 @@ def process_round_end():
 
     if player_data[0]["hp"] <= 0 or player_data[1]["hp"] <= 0:
         game_over = True
+        room["game_started"] = False   # no more choices or insta-wins until the room is reset
         winner_name_0 = player_data[0]["username"]
         winner_name_1 = player_data[1]["username"]
         if player_data[0]["hp"] <= 0 and player_data[1]["hp"] <= 0:
@@ -104,190 +394,674 @@ def process_round_end():
             result_message = f"{winner_name_1} wins the game!"
         else:
             result_message = f"{winner_name_0} wins the game!"
+        if player_stats:
+            record_player_stats(room)
+        end_match(room)
 
     round_results = {
         "message": result_message,
-        "player0_choice": choice0,
-        "player1_choice": choice1,
+        "player0_choice": ALL_POSSIBLE_CARDS[card_id0],
+        "player1_choice": ALL_POSSIBLE_CARDS[card_id1],
         "rps_winner": winner_id,
-        "hps": {i: player_data[i]["hp"] for i in range(2)},
+        "hps": hps(room),
         "round_status": "game_over" if game_over else "round_over",
         "game_over": game_over,
-        "usernames": {i: player_data[i]["username"] for i in range(2)}
+        "usernames": usernames(room)
     }
-    broadcast("round_result", round_results)
+    broadcast_state(room, "round_result", round_results)
 
-    time.sleep(5)
+    schedule(room, "round_result", start_next_round, room, game_over)
 
+def start_next_round(room, game_over):
+    """Resets the room after a finished game, or deals the next round."""
+    room["timer"] = None
+    player_data = room["player_data"]
     if game_over:
-        game_started = False
-        # Reset for  new game
-        for i in range(2):
-            player_data[i].update({
-                "ready": False, "hp": INITIAL_HP, "choice": None, 
-                "hand": [], "username": f"Player {i}"
-            })
-
-      
-        broadcast("game_state", {
+        # Both players go back to the lobby and queue again for their next match.
+        broadcast_state(room, "game_state", {
             "message": "Game Over! Enter a name to play again.",
-            "hps": {i: player_data[i]["hp"] for i in range(2)},
+            "hps": {0: INITIAL_HP, 1: INITIAL_HP},
             "round_status": "entering_username",
             "player_hand": [],
-            "usernames": {i: player_data[i]["username"] for i in range(2)}
+            "usernames": {i: f"Player {i}" for i in range(2)}
         })
+        close_room(room)
+    else:
+        player_data[0]["choice"], player_data[1]["choice"] = None, None
+        deal_cards(room)
+        state = {
+            "message": "New round! Make your choice.",
+            "hps": hps(room),
+            "round_status": "waiting_for_choices",
+            "player_hand": [],
+            "usernames": usernames(room)
+        }
+        for pid, session in room["sessions"].items():
+            send_player_state(session, "game_state", dict(state, player_hand=hand_cards(player_data[pid]["hand"])))
+        fan_out(room, "game_state", state)
+
+def start_game(room):
+    """Deals the first hand once both players in the room are ready."""
+    room["timer"] = None
+    player_data = room["player_data"]
+    if rooms.get(room["id"]) is not room:
+        return
+    deal_cards(room)
+    state = {
+        "message": "Game started! Make your choice.",
+        "hps": hps(room),
+        "round_status": "waiting_for_choices",
+        "player_hand": [],
+        "usernames": usernames(room)
+    }
+    for pid, session in room["sessions"].items():
+        send_player_state(session, "game_state", dict(state, player_hand=hand_cards(player_data[pid]["hand"])))
+    fan_out(room, "game_state", state)
+
+# --- Matchmaking ---
+def open_match(queued, conn, username, no_pauses=False):
+    """Seats two players in a fresh room and starts their match."""
+    global next_room_id
+    room = new_room(next_room_id, NO_PAUSES if no_pauses else None)
+    next_room_id += max(1, WORKERS)   # workers start at their index, so a room id names its worker
+    rooms[room["id"]] = room
+    for player_id, (player_conn, name) in enumerate([queued, (conn, username)]):
+        room["clients"][player_conn] = player_id
+        room["player_data"][player_id]["username"] = name
+        client_rooms[player_conn] = room
+        session = open_session(room, player_id, player_conn)
+        send_message(player_conn, "player_id", {"id": player_id, "token": session["token"]})
+    metrics.incr("matches_started")
+    print(f"Room {room['id']}: {room['player_data'][0]['username']} vs {room['player_data'][1]['username']}. Game starting!")
+
+    broadcast(room, "player_update", {
+        "message": "Opponent found! Game starting...",
+        "usernames": usernames(room)
+    })
+    room["game_started"] = True
+    begin_match(room)
+    schedule(room, "game_start", start_game, room)
+
+def pair_players(queued, conn, username, no_pauses):
+    if worker_links:
+        asyncio.create_task(dispatch_match([queued, (conn, username)], no_pauses))
     else:
-        with clients_lock:
-            p0["choice"], p1["choice"] = None, None
-        deal_cards()
-        with clients_lock:
-            for conn, pid in clients.items():
-                send_pickled(conn, {
-                    "type": "game_state",
-                    "data": {
-                        "message": "New round! Make your choice.",
-                        "hps": {i: player_data[i]["hp"] for i in range(2)},
-                        "round_status": "waiting_for_choices",
-                        "player_hand": player_data[pid]["hand"],
-                        "usernames": {i: player_data[i]["username"] for i in range(2)}
-                    }
-                })
+        open_match(queued, conn, username, no_pauses)
+
+def leave_queue(conn):
+    for match_queue in match_queues.values():
+        match_queue.pop(conn, None)
+
+def is_queued(conn):
+    return any(conn in match_queue for match_queue in match_queues.values())
+
+def queue_player(conn, username, no_pauses=False):
+    """Pairs a ready player with the longest-waiting one, or queues them until an opponent arrives.
+
+    no_pauses asks for a room without round pauses, shared only with another player who asked for one."""
+    if conn in client_rooms:
+        return
+    stop_spectating(conn)
+    if front_link is not None:
+        # Workers only own matches; the front process pairs everyone for the next one.
+        asyncio.create_task(return_to_front(conn, username, no_pauses))
+        return
+    leave_queue(conn)
+    match_queue = match_queues[no_pauses]
+    if match_queue and len(rooms) < MAX_ROOMS:
+        opponent, (opponent_name, queued_at) = match_queue.popitem(last=False)
+        metrics.observe("matchmaking_wait_seconds", time.monotonic() - queued_at)
+        pair_players((opponent, opponent_name), conn, username, no_pauses)
+        return
+    match_queue[conn] = (username, time.monotonic())
+    send_message(conn, "player_update", {
+        "message": f"{username} is ready. Waiting for opponent...",
+        "usernames": {0: username, 1: "Player 1"}
+    })
+
+def close_room(room):
+    """Returns the room's players to the lobby and discards the room."""
+    cancel_timer(room)
+    for conn in room["clients"]:
+        client_rooms.pop(conn, None)
+    for session in room["sessions"].values():
+        close_session(session)
+    for conn in room["spectators"]:
+        spectating.pop(conn, None)
+    del rooms[room["id"]]
+    # A freed room may let players that were queued at MAX_ROOMS start.
+    for no_pauses, match_queue in match_queues.items():
+        while len(match_queue) >= 2 and len(rooms) < MAX_ROOMS:
+            first, (first_name, queued_at) = match_queue.popitem(last=False)
+            second, (second_name, _) = match_queue.popitem(last=False)
+            metrics.observe("matchmaking_wait_seconds", time.monotonic() - queued_at)
+            pair_players((first, first_name), second, second_name, no_pauses)
+
+# --- Spectators ---
+def spectate(conn, room_id):
+    """Adds a read-only viewer to a match (SPECTATE_ANY picks the newest one) and sends it the current state."""
+    if conn in client_rooms:
+        return
+    stop_spectating(conn)
+    leave_queue(conn)
+    if room_id == SPECTATE_ANY:
+        room = next((room for room in reversed(rooms.values()) if room["game_started"]), None)
+    else:
+        room = rooms.get(room_id)
+    if room is None or len(room["spectators"]) >= MAX_SPECTATORS:
+        send_message(conn, "error", {"message": "No match to watch." if room is None else "This match has too many spectators."})
+        return
+    room["spectators"].add(conn)
+    spectating[conn] = room
+    metrics.incr("spectators_joined")
+    send_message(conn, "player_update", {
+        "message": f"Watching {room['player_data'][0]['username']} vs {room['player_data'][1]['username']}.",
+        "usernames": usernames(room)
+    })
+    send_spectator_snapshot(conn, room)
+
+def stop_spectating(conn):
+    room = spectating.pop(conn, None)
+    if room is not None:
+        room["spectators"].discard(conn)
+
+# --- Sessions ---
+def open_session(room, player_id, conn):
+    """Issues the resume token a player can reconnect with while the match lasts."""
+    token = secrets.token_hex(16)
+    if worker_index is not None:
+        token = f"{worker_index}.{token}"
+    session = {"token": token, "room": room, "player_id": player_id, "conn": conn, "timer": None, "synced": None, "kind": None}
+    sessions[token] = session
+    room["sessions"][player_id] = session
+    return session
+
+def close_session(session):
+    if session["timer"] is not None:
+        session["timer"].cancel()
+        session["timer"] = None
+    sessions.pop(session["token"], None)
+
+def suspend_session(room, conn, pid):
+    """Holds a dropped player's seat for RESUME_GRACE seconds. Returns False if the match should end now."""
+    session = room["sessions"][pid]
+    session["conn"] = None
+    outbox = outboxes.get(conn)
+    if outbox is not None:
+        session["synced"], session["kind"] = outbox["synced"], outbox["kind"]
+    if not RESUME_GRACE or not room["game_started"] or room["seed"] is None:
+        return False
+    session["timer"] = timer_wheel.schedule(RESUME_GRACE, expire_session, session)
+    print(f"Room {room['id']}: Player {pid} dropped; holding the seat for {RESUME_GRACE:g}s.")
+    broadcast(room, "player_update", {
+        "message": f"{room['player_data'][pid]['username']} lost connection. Waiting for them to reconnect...",
+        "usernames": usernames(room)
+    })
+    return True
+
+def expire_session(session):
+    session["timer"] = None
+    room = session["room"]
+    if rooms.get(room["id"]) is not room:
+        return
+    print(f"Room {room['id']}: Player {session['player_id']} did not reconnect.")
+    end_opponentless_match(room)
+
+def resume_session(conn, token):
+    """Seats a reconnecting client back in its match and sends it one full state snapshot."""
+    if conn in client_rooms:
+        return
+    session = sessions.get(token)
+    if session is None:
+        send_state(conn, "game_state", {
+            "message": "Your match has ended. Enter a name to play again.",
+            "hps": {0: INITIAL_HP, 1: INITIAL_HP},
+            "round_status": "entering_username",
+            "player_hand": [],
+            "usernames": {i: f"Player {i}" for i in range(2)}
+        })
+        return
+    room, pid = session["room"], session["player_id"]
+    old_conn = session["conn"]
+    if old_conn is not None:
+        # The old connection is half-open; the new one takes over its seat and the state it was sent.
+        client_rooms.pop(old_conn, None)
+        room["clients"].pop(old_conn, None)
+        outbox = outboxes.get(old_conn)
+        if outbox is not None:
+            session["synced"], session["kind"] = outbox["synced"], outbox["kind"]
+        old_conn.transport.abort()
+    if session["timer"] is not None:
+        session["timer"].cancel()
+        session["timer"] = None
+    leave_queue(conn)
+    stop_spectating(conn)
+    session["conn"] = conn
+    room["clients"][conn] = pid
+    client_rooms[conn] = room
+    metrics.incr("sessions_resumed")
+    print(f"Room {room['id']}: Player {pid} reconnected.")
+
+    send_message(conn, "player_id", {"id": pid, "token": token})
+    if session["synced"] is not None:
+        snapshot = dict(session["synced"])
+        if snapshot.get("round_status") == "waiting_for_choices" and room["player_data"][pid]["choice"] is not None:
+            snapshot.update(round_status="choice_made", message="Choice locked in! Waiting...")
+        send_state(conn, session["kind"], snapshot)
+    broadcast(room, "player_update", {
+        "message": f"{room['player_data'][pid]['username']} reconnected.",
+        "usernames": usernames(room)
+    })
+
+# --- Heartbeats ---
+def check_heartbeat(conn, outbox):
+    """Pings a client that has gone quiet and closes it if the ping goes unanswered or it idles in
+    the lobby too long. Runs off the timer wheel, one pending check per connection, so received
+    messages only stamp a time and never touch a timer. Either check can be disabled on its own."""
+    if outboxes.get(conn) is not outbox:
+        return
+    now = time.monotonic()
+    delay = math.inf
+    if IDLE_TIMEOUT > 0:
+        idle_left = IDLE_TIMEOUT - (now - outbox["active_at"])
+        if idle_left <= 0 and conn not in client_rooms and not is_queued(conn) and conn not in spectating:
+            reap_connection(conn, "idle")
+            return
+        delay = idle_left if idle_left > 0 else IDLE_TIMEOUT
+    ping_sent_at = outbox["ping_sent_at"]
+    if PING_INTERVAL > 0:
+        if ping_sent_at is not None and outbox["heard_at"] < ping_sent_at:
+            if now - ping_sent_at >= PONG_TIMEOUT:
+                reap_connection(conn, "unresponsive")
+                return
+            delay = min(delay, PONG_TIMEOUT - (now - ping_sent_at))
+        elif now - outbox["heard_at"] >= PING_INTERVAL:
+            outbox["ping_sent_at"] = now
+            send_message(conn, "ping", {})
+            metrics.incr("pings_sent")
+            delay = min(delay, PONG_TIMEOUT)
+        else:
+            delay = min(delay, PING_INTERVAL - (now - outbox["heard_at"]))
+    outbox["heartbeat"] = timer_wheel.schedule(delay, check_heartbeat, conn, outbox)
+
+def reap_connection(conn, reason):
+    """Closes a dead or idle connection; serve_connection then cleans up as for any disconnect."""
+    metrics.incr(f"connections_reaped.{reason}")
+    print(f"Closing {reason} connection {conn.get_extra_info('peername')}.")
+    conn.transport.abort()
+
+# --- Sharding ---
+async def release_connection(conn):
+    """Flushes everything queued for conn and detaches it from this process.
+
+    Returns a duplicate of the socket's file descriptor to pass on, or None if the client is gone."""
+    outbox = outboxes.pop(conn, None)
+    if outbox is None:
+        return None   # already disconnected and cleaned up by serve_connection
+    outbox["task"].cancel()
+    if outbox["heartbeat"] is not None:
+        outbox["heartbeat"].cancel()
+    conn.transport.pause_reading()
+    try:
+        conn.writelines([frame for _, frame in outbox["queue"]])
+        conn.transport.set_write_buffer_limits(high=0)
+        await conn.drain()
+        fd = os.dup(conn.get_extra_info("socket").fileno())
+    except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
+        fd = None
+    handed_off.add(conn)
+    conn.transport.abort()
+    return fd
+
+async def adopt_connection(fd):
+    """Serves a client socket handed over by another process and returns its conn."""
+    reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=fd), limit=READ_CHUNK)
+    open_outbox(writer)
+    asyncio.create_task(serve_connection(reader, writer))
+    return writer
+
+def send_to_shard(link, message, fds):
+    """Passes client sockets to another process with what it should do with them:
+    {"match": [name0, name1], "no_pauses": bool}, {"queue": name, "no_pauses": bool},
+    {"resume": token} or {"spectate": room_id}.
+
+    Returns False if the other process is gone, leaving the fds open for the caller to take back."""
+    try:
+        socket.send_fds(link, [json.dumps(message).encode("utf-8")], fds)
+    except OSError:
+        return False
+    for fd in fds:
+        os.close(fd)
+    return True
+
+def pick_worker():
+    """Front: returns the index of the next live worker, round robin."""
+    global next_worker
+    indices = sorted(worker_links)
+    next_worker = (next_worker + 1) % len(indices)
+    return indices[next_worker]
+
+def drop_worker(index):
+    """Front: stops handing anything to a worker that has exited; its matches are gone with it."""
+    link = worker_links.pop(index, None)
+    if link is None:
+        return
+    asyncio.get_running_loop().remove_reader(link.fileno())
+    link.close()
+    metrics.incr("workers_lost")
+    print(f"Worker {index} exited; {len(worker_links)} left" + ("." if worker_links else ", serving matches here."))
+
+async def dispatch_match(players, no_pauses):
+    """Front: hands a paired match to the next worker, which opens it."""
+    fds = [await release_connection(conn) for conn, _ in players]
+    if None not in fds:
+        if worker_links:
+            index = pick_worker()
+            if send_to_shard(worker_links[index], {"match": [username for _, username in players], "no_pauses": no_pauses}, fds):
+                return
+            drop_worker(index)
+    # One player left while the match was being handed off, or its worker is gone; whoever is
+    # still here queues again (and is paired with a live worker, or here if none is left).
+    for fd, (_, username) in zip(fds, players):
+        if fd is not None:
+            queue_player(await adopt_connection(fd), username, no_pauses)
+
+async def return_to_front(conn, username, no_pauses):
+    """Worker: hands a player who is ready for a new match back to the front's queue."""
+    fd = await release_connection(conn)
+    if fd is not None and not send_to_shard(front_link, {"queue": username, "no_pauses": no_pauses}, [fd]):
+        os.close(fd)   # the front is gone and this worker is about to exit
+
+def receive_from_shard(link, closed=None):
+    """Reads one hand-off message: the worker opens a match, the front queues the returning player."""
+    try:
+        data, fds, _, _ = socket.recv_fds(link, SHARD_MESSAGE_SIZE, 2)
+    except OSError:
+        data = b""   # the other process died with something unread
+    if not data:
+        if closed:
+            asyncio.get_running_loop().remove_reader(link.fileno())
+            print("Front process is gone; worker exiting.")
+            closed.set_result(None)
+        else:
+            drop_worker(next(index for index, other in worker_links.items() if other is link))
+        return
+    asyncio.create_task(adopt_players(fds, json.loads(data)))
+
+async def hand_to_worker(conn, index, message):
+    """Front: hands a client to a worker, or serves it here if that worker is gone."""
+    fd = await release_connection(conn)
+    if fd is None:
+        return
+    link = worker_links.get(index)
+    if link is not None and send_to_shard(link, message, [fd]):
+        return
+    if link is not None:
+        drop_worker(index)
+    # Its match went with the worker: a resume is told the match ended, a spectator finds none.
+    await adopt_players([fd], message)
+
+def route_resume(conn, token):
+    """Front: hands a reconnecting client to the worker whose index prefixes its token."""
+    index, _, _ = token.partition(".")
+    if not index.isdigit() or int(index) not in worker_links:
+        resume_session(conn, token)
+        return
+    leave_queue(conn)
+    stop_spectating(conn)
+    asyncio.create_task(hand_to_worker(conn, int(index), {"resume": token}))
+
+def route_spectator(conn, room_id):
+    """Front: hands a spectator to the worker that owns the room (any worker for SPECTATE_ANY)."""
+    index = pick_worker() if room_id == SPECTATE_ANY else room_id % WORKERS
+    leave_queue(conn)
+    asyncio.create_task(hand_to_worker(conn, index, {"spectate": room_id}))
+
+async def adopt_players(fds, message):
+    conns = [await adopt_connection(fd) for fd in fds]
+    if "match" in message:
+        names = message["match"]
+        open_match((conns[0], names[0]), conns[1], names[1], message["no_pauses"])
+    elif "queue" in message:
+        queue_player(conns[0], message["queue"], message["no_pauses"])
+    elif "resume" in message:
+        resume_session(conns[0], message["resume"])
+    elif "spectate" in message:
+        spectate(conns[0], message["spectate"])
+
+def run_worker(index, link):
+    """Entry point of a worker process: serves the matches the front hands it."""
+    global front_link, worker_index, next_room_id, STATS_PORT, REPLAY_LOG
+    front_link, worker_index, next_room_id = link, index, index
+    # The front's ends of the links (ours included) belong to the front; holding ours open
+    # would keep us from seeing the front close it.
+    for other in worker_links.values():
+        other.close()
+    worker_links.clear()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # the front shuts the workers down
+    STATS_PORT = STATS_PORT + 1 + index if STATS_PORT else 0
+    REPLAY_LOG = f"{REPLAY_LOG}.{index}" if REPLAY_LOG else None
+    try:
+        asyncio.run(serve_worker(index))
+    finally:
+        if player_stats:
+            player_stats.close()
+
+def start_workers():
+    """Forks the worker processes, each connected to the front by a Unix socket pair."""
+    context = multiprocessing.get_context("fork")
+    for index in range(WORKERS):
+        front_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        worker_links[index] = front_end
+        process = context.Process(target=run_worker, args=(index, worker_end), daemon=True)
+        process.start()
+        worker_processes.append(process)
+        worker_end.close()
 
 def handle_disconnect(conn):
-    global game_started
-    with clients_lock:
-        if conn in clients:
-            pid = clients[conn]
-            print(f"Player {pid} disconnected.")
-            del clients[conn]
-            
-            game_started = False
-            for i in range(2):
-                player_data[i].update({
-                    "ready": False, "hp": INITIAL_HP, "choice": None,
-                    "hand": [], "username": f"Player {i}"
-                })
-            
-            broadcast("game_state", {
-                "message": "A player disconnected. Waiting for players...",
-                "hps": {0: INITIAL_HP, 1: INITIAL_HP},
-                "round_status": "entering_username",
-                "player_hand": [],
-                "usernames": {i: player_data[i]["username"] for i in range(2)}
-            })
+    leave_queue(conn)
+    stop_spectating(conn)
+    room = client_rooms.pop(conn, None)
+    if room is None:
+        return
+    pid = room["clients"].pop(conn)
+    if suspend_session(room, conn, pid):
+        return
+    print(f"Room {room['id']}: Player {pid} disconnected.")
+    end_opponentless_match(room)
+
+def end_opponentless_match(room):
+    """Ends a match a player has left for good and sends whoever is still connected back to the lobby."""
+    room["game_started"] = False
+    cancel_timer(room)
+    end_match(room)
+
+    broadcast_state(room, "game_state", {
+        "message": "Your opponent disconnected. Enter a name to find a new match.",
+        "hps": {0: INITIAL_HP, 1: INITIAL_HP},
+        "round_status": "entering_username",
+        "player_hand": [],
+        "usernames": {i: f"Player {i}" for i in range(2)}
+    })
+    close_room(room)
+
+def handle_message(conn, msg_type, msg_data):
+    if msg_type == "pong":
+        outbox = outboxes.get(conn)
+        if outbox is not None and outbox["ping_sent_at"] is not None:
+            metrics.observe("ping_rtt_seconds", time.monotonic() - outbox["ping_sent_at"])
+            outbox["ping_sent_at"] = None
+        return
+    if msg_type == "ready":
+        queue_player(conn, msg_data.get("username") or "Player", msg_data["no_pauses"])
+        return
+    if msg_type == "resync":
+        resync(conn)
+        return
+    if msg_type == "resume":
+        if worker_links:
+            route_resume(conn, msg_data["token"])
+        else:
+            resume_session(conn, msg_data["token"])
+        return
+    if msg_type == "spectate":
+        if worker_links:
+            route_spectator(conn, msg_data["room_id"])
+        else:
+            spectate(conn, msg_data["room_id"])
+        return
+    room = client_rooms.get(conn)
+    if room is None:
+        return
+    player_data = room["player_data"]
+    player_id = room["clients"][conn]
+    if msg_type == "choice" and room["game_started"]:
+        hand = player_data[player_id]["hand"]
+        if player_data[player_id]["choice"] is None and msg_data["index"] < len(hand):
+            player_data[player_id]["choice"] = hand[msg_data["index"]]
+            if all(p["choice"] is not None for p in player_data.values()):
+                schedule(room, "choice_reveal", process_round_end, room)
+
+    elif msg_type == "insta_win" and room["game_started"]:
+        opponent_id = 1 - player_id
+        player_data[opponent_id]['hp'] = 0
+        if replay_log and room["seed"] is not None:
+            replay_log.insta_win(room["seed"], player_id)
+        if player_data[player_id]['choice'] is None:
+            player_data[player_id]['choice'] = rules.CARD_IDS[(0, "none")]
+        if player_data[opponent_id]['choice'] is None:
+            player_data[opponent_id]['choice'] = rules.CARD_IDS[(2, "none")]
+        cancel_timer(room)
+        process_round_end(room)
 
 # --- Main Client--
-def handle_client(conn, player_id):
-    global game_started
+async def handle_client(reader, writer):
+    conn = writer
+    addr = writer.get_extra_info("peername")
+    if len(outboxes) >= MAX_CLIENTS:
+        metrics.incr("connections_rejected")
+        print(f"Rejected connection from {addr}: Server is full.")
+        writer.write(protocol.encode_message("error", {"message": "Server is full."}))
+        writer.close()
+        return
+    open_outbox(conn)
+    metrics.incr("connections_accepted")
+    print(f"Accepted connection from {addr}.")
+    await serve_connection(reader, writer)
+
+async def serve_connection(reader, writer):
+    conn = writer
     try:
-        send_pickled(conn, {"type": "player_id", "data": {"id": player_id}})
-        
-        full_msg, new_msg = b'', True
+        decoder = protocol.FrameDecoder(READ_CHUNK, MAX_FRAME_SIZE, protocol.CLIENT_MESSAGES)
+        budget, refilled_at = READ_BUDGET, time.monotonic()
+        outbox = outboxes[conn]
         while True:
-            chunk = conn.recv(4096)
+            chunk = await reader.read(READ_CHUNK)
             if not chunk:
                 break
-            full_msg += chunk
-            while True:
-                if new_msg:
-                    if len(full_msg) < HEADER_LENGTH:
-                        break
-                    msg_len = int(full_msg[:HEADER_LENGTH])
-                    new_msg = False
-                
-                if len(full_msg) - HEADER_LENGTH < msg_len:
-                    break
-                
-                data_object = pickle.loads(full_msg[HEADER_LENGTH : HEADER_LENGTH + msg_len])
-                msg_type, msg_data = data_object.get("type"), data_object.get("data")
-
-                if msg_type == "ready":
-                    if "username" in msg_data and msg_data["username"]:
-                        player_data[player_id]["username"] = msg_data["username"]
-                    
-                    player_data[player_id]["ready"] = True
-                    print(f"Player {player_id} ({player_data[player_id]['username']}) is ready.")
-                    
-                    broadcast("player_update", {
-                        "message": f"{player_data[player_id]['username']} is ready. Waiting for opponent...",
-                        "usernames": {i: player_data[i]["username"] for i in range(2)}
-                    })
-                    
-                    with clients_lock:
-                        if len(clients) == 2 and all(p["ready"] for p in player_data.values()):
-                            game_started = True
-                            print("Both players ready. Game starting!")
-                            time.sleep(1)
-                            for i in range(2): player_data[i]["ready"] = False
-                            deal_cards()
-                            for c, pid in clients.items():
-                                send_pickled(c, {
-                                    "type": "game_state",
-                                    "data": {
-                                        "message": "Game started! Make your choice.",
-                                        "hps": {i: player_data[i]["hp"] for i in range(2)},
-                                        "round_status": "waiting_for_choices",
-                                        "player_hand": player_data[pid]["hand"],
-                                        "usernames": {i: player_data[i]["username"] for i in range(2)}
-                                    }
-                                })
-                
-                elif msg_type == "choice" and game_started:
-                    should_process = False
-                    with clients_lock:
-                        if player_data[player_id]["choice"] is None: 
-                            player_data[player_id]["choice"] = msg_data["choice"]
-                            if all(p["choice"] is not None for p in player_data.values()):
-                                should_process = True
-                    if should_process:
-                        time.sleep(0.5)
-                        process_round_end()
-                
-                elif msg_type == "insta_win" and game_started:
-                    opponent_id = 1 - player_id
-                    with clients_lock:
-                        player_data[opponent_id]['hp'] = 0
-                        if player_data[player_id]['choice'] is None:
-                            player_data[player_id]['choice'] = {"rps_value": 0, "effect": "none"}
-                        if player_data[opponent_id]['choice'] is None:
-                            player_data[opponent_id]['choice'] = {"rps_value": 2, "effect": "none"}
-                    process_round_end()
-
-                full_msg = full_msg[HEADER_LENGTH + msg_len:]
-                new_msg = True
-                if not full_msg:
-                    break
+            now = outbox["heard_at"] = time.monotonic()
+            metrics.incr("bytes_in", len(chunk))
+            decoder.feed(chunk)
+            for msg_type, msg_data in decoder.frames():
+                metrics.incr(f"messages_decoded.{msg_type}")
+                if msg_type != "pong":
+                    outbox["active_at"] = now
+                handle_message(conn, msg_type, msg_data)
+            if READ_BUDGET:
+                budget = min(READ_BUDGET, budget + (now - refilled_at) * READ_BUDGET) - len(chunk)
+                refilled_at = now
+                if budget < 0:
+                    # Stop reading until the budget refills; the peer's sends back up meanwhile.
+                    metrics.incr("reads_throttled")
+                    await asyncio.sleep(-budget / READ_BUDGET)
+    except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
+        pass
+    except protocol.ProtocolError as e:
+        metrics.incr("protocol_errors")
+        print(f"Closing {writer.get_extra_info('peername')}: {e}")
     except Exception as e:
-        print(f"Error in handle_client for Player {player_id}: {e}")
+        print(f"Error in handle_client for {writer.get_extra_info('peername')}: {e}")
     finally:
-        handle_disconnect(conn)
-        conn.close()
+        if conn in handed_off:
+            handed_off.discard(conn)
+            leave_queue(conn)   # in case it readied again while it was being handed off
+        else:
+            handle_disconnect(conn)
+            close_outbox(conn)
+            writer.close()
+
+async def start_services():
+    """Starts what every process runs next to its connections: timers, stats and the replay log."""
+    global replay_log, player_stats
+    if REPLAY_LOG and not worker_links:
+        replay_log = replay.ReplayWriter(REPLAY_LOG)
+        print(f"Logging matches to {REPLAY_LOG}")
+    if STATS_DB and not worker_links:
+        player_stats = stats_store.StatsStore(STATS_DB)
+        print(f"Recording player stats in {STATS_DB}")
+    timer_wheel.start()
+    background = [asyncio.create_task(metrics.watch_loop_lag())]
+    if STATS_INTERVAL > 0:
+        background.append(asyncio.create_task(metrics.dump_periodically(STATS_INTERVAL)))
+    if STATS_PORT:
+        await metrics.serve_stats(STATS_HOST, STATS_PORT)
+        print(f"Stats available on http://{STATS_HOST}:{STATS_PORT}/")
+    return background
+
+async def serve():
+    background = await start_services()
+    loop = asyncio.get_running_loop()
+    for link in worker_links.values():
+        loop.add_reader(link.fileno(), receive_from_shard, link)
+    server = await asyncio.start_server(handle_client, HOST, PORT, reuse_address=True, backlog=1024, limit=READ_CHUNK)
+    print(f"Server listening on {HOST}:{PORT}" + (f" with {len(worker_links)} workers" if worker_links else ""))
+    async with server:
+        await server.serve_forever()
+
+async def serve_worker(index):
+    background = await start_services()
+    closed = asyncio.get_running_loop().create_future()
+    asyncio.get_running_loop().add_reader(front_link.fileno(), receive_from_shard, front_link, closed)
+    print(f"Worker {index} (pid {os.getpid()}) ready.")
+    await closed
 
 def start_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(2)
-    print(f"Server listening on {HOST}:{PORT}")
-    while True:
-        try:
-            conn, addr = server_socket.accept()
-            with clients_lock:
-                if len(clients) < 2:
-                    current_pids = set(clients.values())
-                    assigned_id = 0 if 0 not in current_pids else 1
-                    clients[conn] = assigned_id
-                    player_data[assigned_id].update({
-                        "ready": False, "choice": None, "username": f"Player {assigned_id}"
-                    })
-                    print(f"Accepted connection from {addr}. Assigned Player ID: {assigned_id}.")
-                    threading.Thread(target=handle_client, args=(conn, assigned_id), daemon=True).start()
-                else:
-                    print(f"Rejected connection from {addr}: Server is full.")
-                    send_pickled(conn, {"type": "error", "data": {"message": "Server is full."}})
-                    conn.close()
-        except Exception as e:
-            print(f"Error in server loop: {e}")
+    if WORKERS > 1:
+        start_workers()
+    try:
+        asyncio.run(serve())
+    finally:
+        # Closing its link tells a worker to exit once it has flushed its stats store.
+        for link in worker_links.values():
+            link.close()
+        for process in worker_processes:
+            process.join(WORKER_SHUTDOWN_TIMEOUT)
+        if player_stats:
+            player_stats.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rock-Paper-Scissors game server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--no-pauses", action="store_true", help="skip the round pauses in every room, not only those asked for on ready")
+    parser.add_argument("--stats-port", type=int, default=STATS_PORT, help="local JSON stats endpoint port (0 disables)")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL, help="seconds between stats dumps to stdout (0 disables)")
+    parser.add_argument("--replay-log", default=REPLAY_LOG, help="append every match to this replay log (see replay.py)")
+    parser.add_argument("--stats-db", default=STATS_DB, help="record player stats and the leaderboard in this SQLite file (see stats_store.py)")
+    parser.add_argument("--max-frame-size", type=int, default=MAX_FRAME_SIZE, help="largest payload accepted from a client, in bytes")
+    parser.add_argument("--read-budget", type=int, default=READ_BUDGET, help="bytes per second a client may send before reads pause (0 disables)")
+    parser.add_argument("--ping-interval", type=float, default=PING_INTERVAL, help="seconds of client silence before a heartbeat ping (0 disables)")
+    parser.add_argument("--pong-timeout", type=float, default=PONG_TIMEOUT, help="seconds a client has to answer a ping")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="seconds a connection may idle in the lobby (0 disables)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes that own matches (Unix only)")
+    args = parser.parse_args()
+    HOST, PORT = args.host, args.port
+    STATS_PORT, STATS_INTERVAL = args.stats_port, args.stats_interval
+    REPLAY_LOG = args.replay_log
+    STATS_DB = args.stats_db
+    MAX_FRAME_SIZE, READ_BUDGET = args.max_frame_size, args.read_budget
+    PING_INTERVAL, PONG_TIMEOUT, IDLE_TIMEOUT = args.ping_interval, args.pong_timeout, args.idle_timeout
+    WORKERS = args.workers
+    if args.no_pauses:
+        ROUND_PAUSES.update(NO_PAUSES)
     start_server()
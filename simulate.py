@@ -0,0 +1,132 @@
+"""Monte Carlo balance simulator for the card pool.
+
+Plays many full games at once with NumPy, dealing hands like the server's
+deal_cards and resolving rounds through the same outcome table as
+process_round_end (rules.compile_outcomes). Requires numpy, which the
+game itself does not need.
+
+    python simulate.py --games 1000000 --policy0 greedy --policy1 random
+    python simulate.py --hp 150 --base-damage 15 --hand-size 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+import rules
+
+MAX_ROUNDS = 1000   # games still running after this many rounds are reported as unfinished
+
+
+def expected_gain(outcomes, num_cards):
+    """Average (damage dealt - damage taken) of each card against a uniformly random opposing card."""
+    table = np.array(outcomes).reshape(num_cards, num_cards, 3)
+    return (table[:, :, 2] - table[:, :, 1]).mean(axis=1)
+
+def make_policies(outcomes, num_cards):
+    """Policies map (rng, hands of card ids with shape (games, hand size)) to the chosen card ids."""
+    gain = expected_gain(outcomes, num_cards)
+    return {
+        "random": lambda rng, hands: hands[np.arange(len(hands)), rng.integers(0, hands.shape[1], len(hands))],
+        "first": lambda rng, hands: hands[:, 0],
+        "greedy": lambda rng, hands: hands[np.arange(len(hands)), gain[hands].argmax(axis=1)],
+    }
+
+def deal(rng, games, num_cards, hand_size):
+    """Random hands without repeated cards, like random.sample(ALL_POSSIBLE_CARDS, hand_size)."""
+    return rng.random((games, num_cards)).argpartition(hand_size - 1, axis=1)[:, :hand_size]
+
+def simulate(games, policy0="random", policy1="random", initial_hp=rules.INITIAL_HP,
+             base_damage=rules.BASE_DAMAGE_PER_ROUND, hand_size=rules.NUM_CARDS_IN_HAND, seed=None):
+    cards = rules.ALL_POSSIBLE_CARDS
+    num_cards = len(cards)
+    outcomes = rules.compile_outcomes(cards, rules.CARD_EFFECTS, base_damage)
+    table = np.array(outcomes, dtype=np.int32)
+    winner_table, damage0_table, damage1_table = table[:, 0], table[:, 1], table[:, 2]
+    policies = make_policies(outcomes, num_cards)
+    choose0, choose1 = policies[policy0], policies[policy1]
+
+    effect_names = list(rules.CARD_EFFECTS)
+    card_effect = np.array([effect_names.index(card["effect"]) for card in cards])
+    num_effects = len(effect_names)
+
+    rng = np.random.default_rng(seed)
+    hp0 = np.full(games, initial_hp, dtype=np.int32)
+    hp1 = np.full(games, initial_hp, dtype=np.int32)
+    rounds = np.zeros(games, dtype=np.int32)
+    active = np.arange(games)
+    effect_played = np.zeros(num_effects, dtype=np.int64)
+    effect_won = np.zeros(num_effects, dtype=np.int64)
+    effect_dealt = np.zeros(num_effects, dtype=np.int64)
+    effect_taken = np.zeros(num_effects, dtype=np.int64)
+
+    for _ in range(MAX_ROUNDS):
+        if not len(active):
+            break
+        count = len(active)
+        card0 = choose0(rng, deal(rng, count, num_cards, hand_size))
+        card1 = choose1(rng, deal(rng, count, num_cards, hand_size))
+        index = card0 * num_cards + card1
+        winner, damage0, damage1 = winner_table[index], damage0_table[index], damage1_table[index]
+
+        hp0[active] = np.maximum(0, hp0[active] - damage0)
+        hp1[active] = np.maximum(0, hp1[active] - damage1)
+        rounds[active] += 1
+
+        for played, won, dealt, taken in ((card0, winner == 0, damage1, damage0), (card1, winner == 1, damage0, damage1)):
+            effect = card_effect[played]
+            effect_played += np.bincount(effect, minlength=num_effects)
+            effect_won += np.bincount(effect, weights=won, minlength=num_effects).astype(np.int64)
+            effect_dealt += np.bincount(effect, weights=dealt, minlength=num_effects).astype(np.int64)
+            effect_taken += np.bincount(effect, weights=taken, minlength=num_effects).astype(np.int64)
+
+        active = active[(hp0[active] > 0) & (hp1[active] > 0)]
+
+    finished = (hp0 <= 0) | (hp1 <= 0)
+    return {
+        "games": games,
+        "p0_wins": int(np.count_nonzero((hp1 <= 0) & (hp0 > 0))),
+        "p1_wins": int(np.count_nonzero((hp0 <= 0) & (hp1 > 0))),
+        "draws": int(np.count_nonzero((hp0 <= 0) & (hp1 <= 0))),
+        "unfinished": int(np.count_nonzero(~finished)),
+        "rounds": rounds[finished],
+        "effects": {
+            name: {"played": int(effect_played[i]), "won": int(effect_won[i]),
+                   "dealt": int(effect_dealt[i]), "taken": int(effect_taken[i])}
+            for i, name in enumerate(effect_names)
+        },
+    }
+
+def report(results, elapsed):
+    games = results["games"]
+    rounds = results["rounds"]
+    print(f"Simulated {games} games in {elapsed:.2f}s ({games / elapsed:,.0f} games/s)")
+    print(f"Player 0 wins: {results['p0_wins'] / games:7.2%}")
+    print(f"Player 1 wins: {results['p1_wins'] / games:7.2%}")
+    print(f"Draws:         {results['draws'] / games:7.2%}")
+    if results["unfinished"]:
+        print(f"Unfinished after {MAX_ROUNDS} rounds: {results['unfinished']}")
+    if len(rounds):
+        p10, p50, p90 = np.percentile(rounds, [10, 50, 90])
+        print(f"Game length:   mean {rounds.mean():.2f} rounds, p10 {p10:.0f}, median {p50:.0f}, p90 {p90:.0f}, max {rounds.max()}")
+    print(f"{'Effect':<20}{'played':>12}{'win rate':>10}{'dealt/play':>12}{'taken/play':>12}")
+    for name, stats in results["effects"].items():
+        played = max(1, stats["played"])
+        print(f"{name:<20}{stats['played']:>12}{stats['won'] / played:>10.2%}{stats['dealt'] / played:>12.2f}{stats['taken'] / played:>12.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo balance simulator for the card pool")
+    parser.add_argument("--games", type=int, default=1_000_000)
+    parser.add_argument("--policy0", default="random", choices=["random", "first", "greedy"])
+    parser.add_argument("--policy1", default="random", choices=["random", "first", "greedy"])
+    parser.add_argument("--hp", type=int, default=rules.INITIAL_HP, help="starting HP (INITIAL_HP)")
+    parser.add_argument("--base-damage", type=int, default=rules.BASE_DAMAGE_PER_ROUND, help="BASE_DAMAGE_PER_ROUND")
+    parser.add_argument("--hand-size", type=int, default=rules.NUM_CARDS_IN_HAND, help="NUM_CARDS_IN_HAND")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if not 1 <= args.hand_size <= rules.NUM_CARDS:
+        parser.error(f"--hand-size must be between 1 and the {rules.NUM_CARDS} cards in the pool")
+
+    started = time.perf_counter()
+    results = simulate(args.games, args.policy0, args.policy1, args.hp, args.base_damage, args.hand_size, args.seed)
+    report(results, time.perf_counter() - started)
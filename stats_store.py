@@ -0,0 +1,166 @@
+"""Persistent per-username player stats and leaderboard in SQLite.
+
+The server hands each finished match to a StatsStore, which only puts it
+on a queue; a background thread owns the database connection and folds
+everything queued during the last FLUSH_INTERVAL into one transaction
+of upserts. A slow disk or a locked database delays that thread, never
+the round loop. Several worker processes can share one database file
+(WAL mode lets the leaderboard be read while they write).
+
+    python stats_store.py stats.db              # top 10 by wins
+    python stats_store.py stats.db --top 50
+    python stats_store.py stats.db --player alice
+"""
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import rules
+
+FLUSH_INTERVAL = 1.0   # seconds between write transactions
+BUSY_TIMEOUT = 30.0    # seconds a writer waits for another process's transaction
+PLAYER_TOTALS = ["games", "wins", "losses", "draws", "rounds", "damage_dealt", "damage_taken"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    username TEXT PRIMARY KEY,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    rounds INTEGER NOT NULL DEFAULT 0,
+    damage_dealt INTEGER NOT NULL DEFAULT 0,
+    damage_taken INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS players_by_wins ON players (wins DESC, games);
+CREATE TABLE IF NOT EXISTS card_usage (
+    username TEXT NOT NULL,
+    card_id INTEGER NOT NULL,
+    plays INTEGER NOT NULL,
+    PRIMARY KEY (username, card_id)
+) WITHOUT ROWID;
+"""
+UPSERT_PLAYER = (
+    f"INSERT INTO players (username, {', '.join(PLAYER_TOTALS)}) VALUES (?{', ?' * len(PLAYER_TOTALS)}) "
+    f"ON CONFLICT (username) DO UPDATE SET {', '.join(f'{name} = {name} + excluded.{name}' for name in PLAYER_TOTALS)}"
+)
+UPSERT_CARD = ("INSERT INTO card_usage (username, card_id, plays) VALUES (?, ?, ?) "
+               "ON CONFLICT (username, card_id) DO UPDATE SET plays = plays + excluded.plays")
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class StatsStore:
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.pending = queue.SimpleQueue()
+        self.db = connect(path)
+        self.thread = threading.Thread(target=self._run, name="stats-writer", daemon=True)
+        self.thread.start()
+
+    def record_match(self, players, rounds):
+        """Queues one finished match. players holds, for each player, a dict with
+        username, result ("win", "loss" or "draw"), damage_dealt, damage_taken and
+        card_plays (play count per card id)."""
+        self.pending.put((players, rounds))
+
+    def close(self):
+        """Writes whatever is still queued and stops the writer thread."""
+        self.pending.put(None)
+        self.thread.join()
+        self.db.close()
+
+    def _run(self):
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            batch, closing = [], False
+            try:
+                while True:
+                    item = self.pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                    if item is None:
+                        closing = True
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self._write(batch)
+                except sqlite3.Error as e:
+                    print(f"Stats store: dropped {len(batch)} matches: {e}")
+            if closing:
+                return
+
+    def _write(self, batch):
+        # Sum the batch per username first, so a busy player costs one upsert per flush.
+        totals = defaultdict(lambda: dict.fromkeys(PLAYER_TOTALS, 0))
+        plays = defaultdict(int)
+        for players, rounds in batch:
+            for player in players:
+                total = totals[player["username"]]
+                total["games"] += 1
+                total[{"win": "wins", "loss": "losses", "draw": "draws"}[player["result"]]] += 1
+                total["rounds"] += rounds
+                total["damage_dealt"] += player["damage_dealt"]
+                total["damage_taken"] += player["damage_taken"]
+                for cid, count in enumerate(player["card_plays"]):
+                    if count:
+                        plays[(player["username"], cid)] += count
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany(UPSERT_PLAYER, ([name] + [total[key] for key in PLAYER_TOTALS] for name, total in totals.items()))
+            self.db.executemany(UPSERT_CARD, ((name, cid, count) for (name, cid), count in plays.items()))
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+
+
+def leaderboard(db, limit=10):
+    """Top players by wins (then fewest games), read through the players_by_wins index."""
+    rows = db.execute(f"SELECT username, {', '.join(PLAYER_TOTALS)} FROM players ORDER BY wins DESC, games LIMIT ?", (limit,))
+    return [dict(zip(["username"] + PLAYER_TOTALS, row)) for row in rows]
+
+def player_stats(db, username):
+    """Totals and per-card play counts of one player, or None if they have not finished a match."""
+    row = db.execute(f"SELECT {', '.join(PLAYER_TOTALS)} FROM players WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        return None
+    stats = dict(zip(PLAYER_TOTALS, row), username=username, card_plays=[0] * rules.NUM_CARDS)
+    for cid, count in db.execute("SELECT card_id, plays FROM card_usage WHERE username = ?", (username,)):
+        if 0 <= cid < rules.NUM_CARDS:
+            stats["card_plays"][cid] = count
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the leaderboard or one player's stats from the server's stats database")
+    parser.add_argument("db")
+    parser.add_argument("--top", type=int, default=10, help="number of leaderboard rows")
+    parser.add_argument("--player", help="show this player's totals and card usage instead")
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    if args.player:
+        stats = player_stats(db, args.player)
+        if stats is None:
+            print(f"No finished matches for {args.player}")
+        else:
+            print(", ".join(f"{key} {stats[key]}" for key in PLAYER_TOTALS))
+            for cid, count in enumerate(stats["card_plays"]):
+                card = rules.ALL_POSSIBLE_CARDS[cid]
+                print(f"  {rules.CHOICES[card['rps_value']]:<9} {card['effect']:<18} {count}")
+    else:
+        print(f"{'#':>3} {'username':<20}{'wins':>8}{'losses':>8}{'draws':>8}{'games':>8}{'win rate':>10}")
+        for rank, row in enumerate(leaderboard(db, args.top), 1):
+            print(f"{rank:>3} {row['username']:<20}{row['wins']:>8}{row['losses']:>8}{row['draws']:>8}{row['games']:>8}"
+                  f"{row['wins'] / max(1, row['games']):>10.1%}")
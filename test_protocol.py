@@ -0,0 +1,54 @@
+"""Checks that FrameDecoder rejects hostile frames and reassembles split ones.
+
+    python -m pytest test_protocol.py
+"""
+import pytest
+
+import protocol
+
+
+def header(msg_type, length):
+    return protocol.HEADER.pack(protocol.PROTOCOL_VERSION, protocol.MESSAGE_CODES[msg_type], length)
+
+def server_decoder():
+    return protocol.FrameDecoder(4096, 1024, protocol.CLIENT_MESSAGES)
+
+def test_oversized_header_is_rejected_before_its_payload_arrives():
+    decoder = server_decoder()
+    decoder.feed(header("ready", 10 ** 9))
+    with pytest.raises(protocol.ProtocolError):
+        list(decoder.frames())
+
+def test_message_type_a_client_may_not_send_is_rejected_at_the_header():
+    decoder = server_decoder()
+    decoder.feed(protocol.encode_message("ping", {}))   # well formed, but only the server sends it
+    with pytest.raises(protocol.ProtocolError):
+        list(decoder.frames())
+
+def test_frame_split_across_feeds_decodes_once_complete():
+    frame = protocol.encode_message("ready", {"username": "alice", "no_pauses": True})
+    decoder = server_decoder()
+    for i in range(len(frame) - 1):
+        decoder.feed(frame[i:i + 1])
+        assert list(decoder.frames()) == []
+    decoder.feed(frame[-1:])
+    assert list(decoder.frames()) == [("ready", {"username": "alice", "no_pauses": True})]
+
+def test_frames_after_a_split_frame_keep_their_order():
+    frames = protocol.encode_message("choice", {"index": 1}) + protocol.encode_message("pong", {})
+    decoder = server_decoder()
+    decoder.feed(frames[:3])
+    decoder.feed(frames[3:])
+    assert list(decoder.frames()) == [("choice", {"index": 1}), ("pong", {})]
+
+@pytest.mark.parametrize("msg_type, payload", [
+    ("choice", b""),                  # truncated: no index byte
+    ("ready", b"\x00\x09abc"),        # truncated: string shorter than its length
+    ("choice", b"\x01\x02"),          # trailing byte after the index
+    ("pong", b"\x00"),                # trailing byte after an empty payload
+])
+def test_malformed_payload_raises_protocol_error(msg_type, payload):
+    decoder = server_decoder()
+    decoder.feed(header(msg_type, len(payload)) + payload)
+    with pytest.raises(protocol.ProtocolError):
+        list(decoder.frames())
@@ -0,0 +1,39 @@
+"""Checks the compiled outcome table and the wire card ids against the game's rules.
+
+    python -m pytest test_rules.py
+"""
+import protocol
+import rules
+
+
+def reference_outcome(card0, card1):
+    """The round resolution process_round_end did inline before the outcome table existed."""
+    if card0["rps_value"] == card1["rps_value"]:
+        return -1, 0, 0
+    winner_id = 0 if card1["rps_value"] in rules.RPS_RULES[card0["rps_value"]] else 1
+    winner_card, loser_card = (card0, card1)[winner_id], (card0, card1)[1 - winner_id]
+    damage_to_loser = 20 if winner_card["effect"] == "power_attack" else rules.BASE_DAMAGE_PER_ROUND
+    damage_to_winner = 5 if loser_card["effect"] == "counter_damage_5" else 0
+    damage = [0, 0]
+    damage[winner_id], damage[1 - winner_id] = damage_to_winner, damage_to_loser
+    return winner_id, damage[0], damage[1]
+
+def test_outcome_table_matches_reference_for_every_pair():
+    cards = rules.ALL_POSSIBLE_CARDS
+    assert len(rules.OUTCOMES) == len(cards) ** 2
+    for id0, card0 in enumerate(cards):
+        for id1, card1 in enumerate(cards):
+            assert rules.resolve_ids(id0, id1) == reference_outcome(card0, card1), (card0, card1)
+
+def test_wire_card_ids_are_rules_card_ids():
+    for cid, card in enumerate(rules.ALL_POSSIBLE_CARDS):
+        assert protocol.card_id(card) == cid
+        assert protocol.card_from_id(cid) == card
+
+def test_round_result_carries_cards_by_id():
+    data = {"message": "", "player0_choice": rules.ALL_POSSIBLE_CARDS[4], "player1_choice": rules.ALL_POSSIBLE_CARDS[8],
+            "rps_winner": 0, "hps": {0: 95, 1: 80}, "round_status": "round_over", "game_over": False,
+            "usernames": {0: "a", 1: "b"}}
+    frame = protocol.encode_message("round_result", data)
+    code, length = protocol.parse_header(frame)
+    assert protocol.decode_payload(code, frame[protocol.HEADER_LENGTH:]) == ("round_result", data)
@@ -0,0 +1,87 @@
+"""Coarse timers for the server's event loop.
+
+A hashed timing wheel keeps thousands of pending room transitions and
+per-connection heartbeat checks (pings, pong and idle deadlines) in fixed
+buckets, so scheduling and cancelling are O(1) and one periodic tick
+fires whatever is due.
+"""
+import asyncio
+import math
+
+
+class Timer:
+    """Handle for a scheduled callback; cancel() is O(1) and safe to repeat."""
+    __slots__ = ("callback", "args", "rounds", "cancelled")
+
+    def __init__(self, callback, args, rounds):
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    def __init__(self, tick=0.05, slots=512):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current_tick = 0
+        self._started_at = None
+        self._task = None
+
+    def start(self):
+        """Starts ticking on the running event loop."""
+        if self._task is None:
+            self._started_at = asyncio.get_running_loop().time()
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, delay, callback, *args):
+        """Runs callback(*args) after roughly delay seconds; delay <= 0 runs it on the next loop pass."""
+        if delay <= 0:
+            timer = Timer(callback, args, 0)
+            asyncio.get_running_loop().call_soon(self._fire, timer)
+            return timer
+        ticks = max(1, math.ceil(delay / self.tick))
+        timer = Timer(callback, args, (ticks - 1) // len(self.slots))
+        self.slots[(self.current_tick + ticks) % len(self.slots)].append(timer)
+        return timer
+
+    def advance(self, now):
+        """Fires every timer due by loop time `now`."""
+        target_tick = int((now - self._started_at) / self.tick)
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            index = self.current_tick % len(self.slots)
+            bucket, pending = self.slots[index], []
+            self.slots[index] = pending
+            for timer in bucket:
+                if timer.cancelled:
+                    continue
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                    pending.append(timer)
+                else:
+                    self._fire(timer)
+
+    def _fire(self, timer):
+        if timer.cancelled:
+            return
+        timer.cancelled = True
+        try:
+            timer.callback(*timer.args)
+        except Exception as e:
+            print(f"Error in timer callback {timer.callback.__name__}: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            next_tick_at = self._started_at + (self.current_tick + 1) * self.tick
+            await asyncio.sleep(max(0, next_tick_at - loop.time()))
+            self.advance(loop.time())